@@ -0,0 +1,220 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+benchmark_catalog.py
+
+ * DESCRIPTION: Benchmarks the DeltaCatalog against synthetic HIR1B metadata lists of growing
+ size. For each size the list is written (once) by synthetic_catalog.py, then measured in a fresh
+ process so that its peak memory is its own: the time to parse the list with process_metadata(),
+ with and without a snapshot, and the mean time of files(), file(), remove_duplicates() and
+ HIRS2NC.find_contexts() over random intervals and granules.
+
+ The results are written as JSON, and may be compared with those of an earlier run, listing the
+ measurements which have grown by more than a threshold.
+
+ Example:
+    python benchmark_catalog.py -l 10000 100000 1000000 -o results.json -c baseline.json
+
+Copyright (c) 2018 University of Wisconsin Regents.
+Licensed under GNU GPLv3.
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import platform
+import resource
+import argparse
+import tempfile
+import subprocess
+from datetime import datetime
+from os.path import abspath, exists, join as pjoin
+
+from synthetic_catalog import write_catalog
+
+COLLECTION = {'HIR1B': 'ARCDATA'}
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.
+
+def mean_ms(func, calls, repeat=3):
+    '''
+    Call func on each of calls, returning the mean time per call in milliseconds, of the
+    fastest of repeat passes.
+    '''
+    best = None
+    for idx in range(repeat):
+        start = time.time()
+        for args in calls:
+            func(*args)
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return 1000. * best / max(1, len(calls))
+
+def measure(path, queries, seed):
+    '''
+    Measure the catalog for the metadata list path, returning a dict of the measurements.
+    '''
+    import flo.sw.hirs2nc as hirs2nc
+    from flo.sw.hirs2nc.delta import DeltaCatalog, FileCache, from_usec
+    from timeutil import TimeInterval, timedelta
+
+    rnd = random.Random(seed)
+    input_locations = {'collection': COLLECTION, 'input_data': {'HIR1B': path}}
+    results = {}
+
+    # Parse the list, the peak memory of the process so far being that of the parse
+    catalog = DeltaCatalog(**input_locations)
+    start = time.time()
+    catalog.process_metadata('HIR1B')
+    results['process_metadata_s'] = time.time() - start
+    results['process_metadata_rss_mb'] = peak_rss_mb()
+
+    # Write a snapshot, then time loading from it
+    snapshot_dir = tempfile.mkdtemp()
+    try:
+        DeltaCatalog(snapshot_dir=snapshot_dir, **input_locations).process_metadata('HIR1B')
+        results['process_metadata_snapshot_ms'] = mean_ms(
+            lambda: DeltaCatalog(snapshot_dir=snapshot_dir,
+                                 **input_locations).process_metadata('HIR1B'), [()], repeat=5)
+    finally:
+        shutil.rmtree(snapshot_dir)
+
+    # Random granules, and the day and month which begin at them
+    keys = sorted(catalog.file_index)
+    granules = []
+    for idx in range(queries):
+        sensor, sat, file_type = rnd.choice(keys)
+        index = catalog.file_index[(sensor, sat, file_type)]
+        granules.append((sat, from_usec(index.begin[rnd.randrange(len(index))])))
+    days = [(sat, TimeInterval(granule, granule + timedelta(days=1)))
+            for sat, granule in granules]
+    months = [(sat, TimeInterval(granule, granule + timedelta(days=30)))
+              for sat, granule in granules[:max(1, queries // 10)]]
+
+    results['files_ms'] = mean_ms(
+        lambda sat, interval: catalog.files('hirs', sat, 'HIR1B', interval), days)
+
+    def uncached_file(sat, granule):
+        catalog.file_cache = FileCache()
+        catalog.file('hirs', sat, 'HIR1B', granule)
+    results['file_ms'] = mean_ms(uncached_file, granules)
+
+    # The raw rows of each month, before files() has removed their duplicate granules
+    def raw_files(sat, interval):
+        index = catalog.index('hirs', sat, 'HIR1B', interval.left)
+        return [catalog.file_info(index.line(row), 'HIR1B')
+                for row in index.overlapping(interval)]
+    month_files = [(raw_files(sat, interval),) for sat, interval in months]
+    results['remove_duplicates_ms'] = mean_ms(catalog.remove_duplicates, month_files)
+
+    # find_contexts, through the catalog already loaded
+    hirs2nc.catalog_registry[hirs2nc.catalog_key(input_locations)] = catalog
+    comp = hirs2nc.HIRS2NC()
+
+    def find_contexts(sat, interval):
+        hirs2nc.set_input_sources(input_locations, satellite=sat)
+        comp.find_contexts(interval, sat, 'benchmark')
+    results['find_contexts_ms'] = mean_ms(find_contexts, months)
+
+    results['peak_rss_mb'] = peak_rss_mb()
+
+    return results
+
+def run(sizes, queries, work_dir, seed):
+    '''
+    Measure each of the list sizes in its own process, writing the lists to work_dir.
+    '''
+    runs = {}
+
+    for lines in sizes:
+        path = pjoin(work_dir, 'HIR1B_{}_s{}.out'.format(lines, seed))
+        if not exists(path):
+            print("Writing {}...".format(path))
+            write_catalog(path, lines, seed=seed)
+
+        print("Measuring {} lines...".format(lines))
+        output = subprocess.check_output(
+            [sys.executable, abspath(__file__), '--measure', path, '-q', str(queries),
+             '--seed', str(seed)], universal_newlines=True)
+        results = json.loads(output.splitlines()[-1])
+        results['file_mb'] = os.stat(path).st_size / 1048576.
+        runs[str(lines)] = results
+
+        for name in sorted(results):
+            print("\t{:36s} {:12.3f}".format(name, results[name]))
+
+    return runs
+
+def compare(runs, baseline, threshold):
+    '''
+    Print each measurement against the same one in baseline, returning those which have grown
+    by more than a factor of threshold.
+    '''
+    regressions = []
+
+    for lines in sorted(runs, key=int):
+        if lines not in baseline:
+            continue
+        print("{} lines:".format(lines))
+        for name in sorted(runs[lines]):
+            old, new = baseline[lines].get(name), runs[lines][name]
+            if not old:
+                continue
+            ratio = new / old
+            flag = ''
+            if ratio > threshold and not name.startswith('file_mb'):
+                flag = '  <-- regression'
+                regressions.append((lines, name, ratio))
+            print("\t{:36s} {:12.3f} {:12.3f} {:8.2f}x{}".format(name, old, new, ratio, flag))
+
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the DeltaCatalog.')
+    parser.add_argument('-l', '--lines', type=int, nargs='+', default=[10000, 100000, 1000000],
+                        help='the sizes of metadata list to measure')
+    parser.add_argument('-q', '--queries', type=int, default=200,
+                        help='the number of random queries of each kind')
+    parser.add_argument('-w', '--work-dir', default=tempfile.gettempdir(),
+                        help='where to write the metadata lists')
+    parser.add_argument('-o', '--output', help='write the results to this JSON file')
+    parser.add_argument('-c', '--compare', help='compare the results with this JSON file')
+    parser.add_argument('-t', '--threshold', type=float, default=1.25,
+                        help='the growth of a measurement counted as a regression')
+    parser.add_argument('--seed', type=int, default=0, help='the random seed')
+    parser.add_argument('--measure', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        print(json.dumps(measure(args.measure, args.queries, args.seed)))
+        return 0
+
+    runs = run(args.lines, args.queries, args.work_dir, args.seed)
+
+    if args.output:
+        record = {'created': datetime.utcnow().isoformat(),
+                  'python': platform.python_version(),
+                  'platform': platform.platform(),
+                  'queries': args.queries,
+                  'seed': args.seed,
+                  'runs': runs}
+        with open(args.output, 'w') as file_obj:
+            json.dump(record, file_obj, indent=2, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare) as file_obj:
+            regressions = compare(runs, json.load(file_obj)['runs'], args.threshold)
+        if regressions:
+            print("{} measurements regressed by more than {}x".format(
+                len(regressions), args.threshold))
+            return 1
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+synthetic_catalog.py
+
+ * DESCRIPTION: Writes synthetic HIR1B metadata lists in the nine column format read by
+ DeltaCatalog, for benchmarking the catalog as the archive grows. Each of the satellites produces
+ a run of ~100 minute granules from around its launch, named NSS.HIRX.<code>.Dyyjjj.SHHMM.EHHMM,
+ with a share of granules received from a second station, of repeated lines, and of granules
+ crossing midnight whose end time is listed on the day they began.
+
+Copyright (c) 2018 University of Wisconsin Regents.
+Licensed under GNU GPLv3.
+"""
+
+import sys
+import random
+import calendar
+import argparse
+from datetime import datetime, timedelta
+
+# The NSS file name code and approximate first day of data of each satellite
+satellites = {
+    'noaa-06': ('NA', datetime(1979, 6, 30)),
+    'noaa-07': ('NC', datetime(1981, 8, 24)),
+    'noaa-08': ('NE', datetime(1983, 5, 3)),
+    'noaa-09': ('NF', datetime(1985, 2, 25)),
+    'noaa-10': ('NG', datetime(1986, 11, 17)),
+    'noaa-11': ('NH', datetime(1988, 11, 8)),
+    'noaa-12': ('ND', datetime(1991, 9, 16)),
+    'noaa-14': ('NJ', datetime(1995, 4, 10)),
+    'noaa-15': ('NK', datetime(1998, 10, 26)),
+    'noaa-16': ('NL', datetime(2001, 3, 20)),
+    'noaa-17': ('NM', datetime(2002, 10, 15)),
+    'noaa-18': ('NN', datetime(2005, 8, 30)),
+    'noaa-19': ('NP', datetime(2009, 6, 2)),
+    'metop-a': ('M2', datetime(2007, 5, 21)),
+    'metop-b': ('M1', datetime(2013, 4, 24)),
+}
+
+stations = ['GC', 'WI', 'SV']
+
+LINE = '{size},{begin},{begin},{end},hirs,{sat},HIR1B,fs,{sat}/{year}/{name}\n'
+
+def hirs_name(code, begin, end, orbit, station):
+    return 'NSS.HIRX.{}.{}.S{}.E{}.B{:05d}{:02d}.{}'.format(
+        code, begin.strftime('D%y%j'), begin.strftime('%H%M'), end.strftime('%H%M'),
+        orbit % 100000, (orbit + 1) % 100, station)
+
+def satellite_lines(sat, count, rnd, second_station=0.03, repeated=0.01, listed_short=0.3):
+    '''
+    Generate count granule lines of sat. second_station is the share of granules also listed
+    from another station, repeated the share listed twice, and listed_short the share of
+    midnight crossing granules whose end time is listed a day early.
+    '''
+    code, start = satellites[sat]
+    station = rnd.choice(stations)
+    orbit = 0
+    lines = 0
+
+    while lines < count:
+        begin = start + timedelta(seconds=rnd.randint(0, 180))
+        end = begin + timedelta(seconds=rnd.randint(5880, 6120))
+        begin_epoch = calendar.timegm(begin.timetuple())
+        end_epoch = calendar.timegm(end.timetuple())
+        name = hirs_name(code, begin, end, orbit, station)
+        size = rnd.randint(2900000, 3300000)
+
+        if end.date() != begin.date() and rnd.random() < listed_short:
+            end_epoch -= 86400
+
+        line = LINE.format(size=size, begin=begin_epoch, end=end_epoch, sat=sat,
+                           year=begin.year, name=name)
+        yield line
+        lines += 1
+
+        chance = rnd.random()
+        if chance < repeated:
+            yield line
+            lines += 1
+        elif chance < repeated + second_station:
+            other = rnd.choice([other for other in stations if other != station])
+            other_end = end + timedelta(seconds=rnd.choice([-300, 0, 300]))
+            yield LINE.format(size=size, begin=begin_epoch,
+                              end=calendar.timegm(other_end.timetuple()), sat=sat,
+                              year=begin.year,
+                              name=hirs_name(code, begin, other_end, orbit, other))
+            lines += 1
+
+        start = end
+        orbit += 1
+
+def write_catalog(path, lines, sats=None, seed=0):
+    '''
+    Write a metadata list of about lines lines to path, shared between the satellites sats
+    (all of them by default), one satellite after another. Returns the number of lines.
+    '''
+    sats = sorted(sats or satellites)
+    rnd = random.Random(seed)
+    written = 0
+
+    with open(path, 'w') as file_obj:
+        for idx, sat in enumerate(sats):
+            count = (lines - written) // (len(sats) - idx)
+            for line in satellite_lines(sat, count, rnd):
+                file_obj.write(line)
+                written += 1
+
+    return written
+
+def main():
+    parser = argparse.ArgumentParser(description='Write a synthetic HIR1B metadata list.')
+    parser.add_argument('path', help='the metadata list to write')
+    parser.add_argument('lines', type=int, help='the number of lines to write')
+    parser.add_argument('-s', '--satellites', nargs='+', choices=sorted(satellites),
+                        help='the satellites to include (default: all)')
+    parser.add_argument('--seed', type=int, default=0, help='the random seed')
+    args = parser.parse_args()
+
+    print(write_catalog(args.path, args.lines, args.satellites, args.seed))
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -8,9 +8,13 @@ Copyright (c) 2018 University of Wisconsin Regents.
 Licensed under GNU GPLv3.
 """
 
+import os
 import sys
+import time
 import traceback
 import logging
+import multiprocessing
+from os.path import abspath, curdir, join as pjoin
 
 from timeutil import TimeInterval, datetime, timedelta
 from flo.ui import local_prepare, local_execute
@@ -78,12 +82,105 @@ def local_execute_example(interval, satellite, hirs2nc_delivery_id, skip_prepare
                 LOG.info("Running hirs2nc local_execute()...")
                 LOG.info("Running context... {}".format(contexts[0]))
                 local_execute(comp, contexts[0])
-        except Exception, err:
+        except Exception as err:
             LOG.error("{}".format(err))
             LOG.debug(traceback.format_exc())
     else:
         LOG.error("There are no valid {} contexts for the interval {}.".format(satellite, interval))
 
+# The computation of each process of local_execute_all()
+pool_comp = None
+
+def setup_pool_process(satellite, verbosity):
+    global pool_comp
+    setup_logging(verbosity)
+    pool_comp = setup_computation(satellite)
+
+def run_pool_context(args):
+    '''
+    Prepare and execute a single context in its own work directory, returning the context,
+    whether it succeeded and how long it took.
+    '''
+    context, work_dir, skip_prepare, skip_execute = args
+
+    start = time.time()
+    try:
+        if not os.path.isdir(work_dir):
+            os.makedirs(work_dir)
+        os.chdir(work_dir)
+
+        if not skip_prepare:
+            LOG.info("Preparing context... {}".format(context))
+            local_prepare(pool_comp, context)
+        if not skip_execute:
+            LOG.info("Running context... {}".format(context))
+            local_execute(pool_comp, context)
+        ok = True
+    except Exception as err:
+        LOG.error("{}: {}".format(context, err))
+        LOG.debug(traceback.format_exc())
+        ok = False
+
+    return context, ok, time.time() - start
+
+def local_execute_all(interval, satellite, hirs2nc_delivery_id, processes=None, work_root=None,
+                      skip_prepare=False, skip_execute=False, verbosity=2):
+    '''
+    Prepare and execute every context in interval, spread over a pool of processes (one per
+    core by default). Each context runs in its own directory under work_root, and the failure
+    of one context does not stop the others.
+    '''
+    setup_logging(verbosity)
+
+    comp = setup_computation(satellite)
+    contexts = comp.find_contexts(interval, satellite, hirs2nc_delivery_id)
+
+    if len(contexts) == 0:
+        LOG.error("There are no valid {} contexts for the interval {}.".format(satellite, interval))
+        return []
+
+    processes = processes or multiprocessing.cpu_count()
+    work_root = abspath(work_root or curdir)
+    LOG.info("Running {} contexts over {} processes...".format(len(contexts), processes))
+
+    jobs = [(context,
+             pjoin(work_root, '{}_{}'.format(satellite, context['granule'].strftime('%Y%m%d%H%M%S'))),
+             skip_prepare, skip_execute)
+            for context in contexts]
+
+    start = time.time()
+    pool = multiprocessing.Pool(processes, setup_pool_process, (satellite, verbosity))
+    try:
+        results = []
+        for context, ok, elapsed in pool.imap_unordered(run_pool_context, jobs):
+            LOG.info("{} {} in {:.1f} seconds".format(context['granule'],
+                                                      'done' if ok else 'FAILED', elapsed))
+            results.append((context, ok, elapsed))
+        pool.close()
+    except BaseException:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+    wall_time = time.time() - start
+
+    results.sort(key=lambda result: result[0]['granule'])
+    failed = [context for context, ok, elapsed in results if not ok]
+    busy_time = sum(elapsed for context, ok, elapsed in results)
+
+    LOG.info("Context timings:")
+    for context, ok, elapsed in results:
+        LOG.info("\t{}: {:8.1f} s{}".format(context['granule'], elapsed, '' if ok else ' FAILED'))
+    LOG.info("{} of {} contexts succeeded in {:.1f} seconds ({:.1f} contexts/hour, "
+             "{:.1f} s mean per context)".format(
+                 len(results) - len(failed), len(results), wall_time,
+                 3600. * len(results) / wall_time if wall_time else 0.,
+                 busy_time / len(results)))
+    for context in failed:
+        LOG.error("Failed context: {}".format(context))
+
+    return results
+
 
 def print_contexts(interval, satellite, hirs2nc_delivery_id, verbosity=2):
 
@@ -12,7 +12,9 @@ import os
 from os.path import basename, dirname, curdir, abspath, isdir, isfile, exists, splitext, join as pjoin
 import sys
 import logging
+import threading
 import traceback
+from collections import OrderedDict
 from subprocess import CalledProcessError
 
 import flo
@@ -35,34 +37,251 @@ from glutil import (
     #set_official_product_metadata,
     FileNotFound
 )
-from flo.sw.hirs2nc.delta import DeltaCatalog
+from flo.sw.hirs2nc.delta import DeltaCatalog, EPOCH
+from flo.sw.hirs2nc.catalog_service import CatalogClient
+from flo.sw.hirs2nc.worker import get_worker
+from flo.sw.hirs2nc.metrics import metered, span, current
+from flo.sw.hirs2nc.prefetch import get_prefetcher
+from flo.sw.hirs2nc.result_cache import get_result_cache
 
 # every module should have a LOG object
 LOG = logging.getLogger(__name__)
 
-def set_input_sources(input_locations):
+# Shared DeltaCatalog instances, keyed by their input locations
+catalog_registry = {}
+
+def catalog_key(input_locations):
+    '''
+    A hashable key for the input locations of a DeltaCatalog, such as
+    {'collection': {...}, 'input_data': {...}}.
+    '''
+    return tuple(sorted((name, tuple(sorted(value.items())) if isinstance(value, dict) else value)
+                        for name, value in input_locations.items()))
+
+def get_catalog(input_locations):
+    '''
+    Return the DeltaCatalog for input_locations, creating it the first time. Subsequent calls
+    share the same instance, refreshed with any changes to the metadata files it has loaded.
+
+    If input_locations has a 'catalog_socket', or HIRS2NC_CATALOG_SOCKET is set, the catalog is
+    a CatalogClient of the catalog daemon listening on that socket, unless it cannot be reached.
+    '''
+    input_locations = dict(input_locations)
+    socket_path = (input_locations.pop('catalog_socket', None)
+                   or os.environ.get('HIRS2NC_CATALOG_SOCKET'))
+    key = catalog_key(input_locations)
+
+    if socket_path:
+        client_key = ('catalog_socket', socket_path) + key
+        try:
+            if client_key in catalog_registry:
+                catalog_registry[client_key].refresh()
+            else:
+                client = CatalogClient(socket_path, **input_locations)
+                client.ping()
+                catalog_registry[client_key] = client
+            return catalog_registry[client_key]
+        except IOError as err:
+            LOG.warning("{}, using a local catalog".format(err))
+            catalog_registry.pop(client_key, None)
+
+    if key in catalog_registry:
+        catalog_registry[key].refresh()
+    else:
+        LOG.debug("Creating a catalog for {}".format(input_locations))
+        catalog_registry[key] = DeltaCatalog(**input_locations)
+
+    return catalog_registry[key]
+
+# The catalog set up for each satellite, for computations which run several satellites at once,
+# and the most recently set up catalog
+satellite_catalogs = {}
+delta_catalog = None
+
+def set_input_sources(input_locations, satellite=None):
     global delta_catalog
-    delta_catalog = DeltaCatalog(**input_locations)
+    delta_catalog = get_catalog(input_locations)
+
+    if satellite is not None:
+        satellite_catalogs[satellite] = delta_catalog
+
+# The ProductIndex of the products which exist, whose granules the tasks of HIRS2NCBatch leave
+# out, or None
+products = None
+
+def set_products(produced):
+    '''
+    Have the tasks built by HIRS2NCBatch leave out the granules which the ProductIndex produced
+    has a product for. Like the input sources, this must be set up the same way wherever the
+    tasks are built.
+    '''
+    global products
+    products = produced
+
+def catalog_for(satellite):
+    '''
+    The catalog set up for satellite, or the most recently set up catalog if there is none.
+    '''
+    return satellite_catalogs.get(satellite, delta_catalog)
+
+# Resolved deliveries and their prepared environments, keyed by delivery_id, most recently
+# used last, with the modification time of the delivery path they were resolved with
+delivery_cache = OrderedDict()
+delivery_cache_size = 8
+delivery_cache_counts = {'hits': 0, 'misses': 0}
+
+def get_delivery(delivery_id):
+    '''
+    Return the hirs2nc delivery for delivery_id and its prepared environment, reusing those
+    of an earlier call unless the delivery path has since changed on disk.
+    '''
+    try:
+        delivery, env, mtime = delivery_cache.pop(delivery_id)
+        if os.stat(delivery.path).st_mtime != mtime:
+            raise KeyError(delivery_id)
+        delivery_cache_counts['hits'] += 1
+    except (KeyError, OSError):
+        delivery_cache_counts['misses'] += 1
+        delivery = delivered_software.lookup('hirs2nc', delivery_id=delivery_id)
+        env = prepare_env([delivery])
+        mtime = os.stat(delivery.path).st_mtime
+
+    delivery_cache[delivery_id] = (delivery, env, mtime)
+    while len(delivery_cache) > delivery_cache_size:
+        delivery_cache.popitem(last=False)
+
+    LOG.info("Delivery cache: {hits} hits, {misses} misses".format(**delivery_cache_counts))
+
+    return delivery, dict(env)
 
 class HIRS2NC(Computation):
 
     parameters = ['granule', 'satellite', 'hirs2nc_delivery_id']
     outputs = ['out']
 
-    def find_contexts(self, time_interval, satellite, hirs2nc_delivery_id):
+    # The sensor and satellite columns of the PTMSX and CFSR files in their metadata lists,
+    # with a satellite of None standing for that of the granules
+    ptmsx_source = ('hirs', None)
+    cfsr_source = ('cfsr', 'cfsr')
+
+    def ancillary_files(self, satellite, time_interval):
+        '''
+        The HIR1B files of satellite which overlap time_interval, each with the PTMSX files
+        which overlap it and the CFSR analyses which bracket it, found by a single sweep of the
+        catalog indices. Returns a list of (hirs_file, ptmsx_files, cfsr_files) in granule order.
+        '''
+        ptmsx_key = (self.ptmsx_source[0], self.ptmsx_source[1] or satellite, 'PTMSX')
+        cfsr_key = (self.cfsr_source[0], self.cfsr_source[1] or satellite, 'CFSR')
+
+        joined = catalog_for(satellite).join('hirs', satellite, 'HIR1B', time_interval,
+                                             overlapping=[ptmsx_key], bracketing=[cfsr_key])
 
-        global delta_catalog
+        return [(hirs_file, matches[ptmsx_key], matches[cfsr_key])
+                for hirs_file, matches in joined]
+
+    def find_contexts(self, time_interval, satellite, hirs2nc_delivery_id, produced=None,
+                      overlaps=None):
+        '''
+        The contexts for the granules of satellite which begin in time_interval. If produced is
+        given, a ProductIndex, the granules which it has a product for are left out. If overlaps
+        is given, an OverlapResolver, the granules which it finds mostly covered by others are
+        left out.
+        '''
+        delta_catalog = catalog_for(satellite)
 
         LOG.debug('delta_catalog.collection = {}'.format(delta_catalog.collection))
         LOG.debug('delta_catalog.input_data = {}'.format(delta_catalog.input_data))
 
-        files = delta_catalog.files('hirs', satellite, 'HIR1B', time_interval)
+        return self.file_contexts(
+            satellite, hirs2nc_delivery_id, produced,
+            [file for file in delta_catalog.files('hirs', satellite, 'HIR1B', time_interval)
+             if file.data_interval.left >= time_interval.left], overlaps)
 
-        return [{'granule': file.data_interval.left,
-                 'satellite': satellite,
-                 'hirs2nc_delivery_id': hirs2nc_delivery_id}
-                for file in files
-                if file.data_interval.left >= time_interval.left]
+    def iter_contexts(self, time_interval, satellite, hirs2nc_delivery_id, produced=None,
+                      chunk_size=1000, overlaps=None):
+        '''
+        Yield the contexts of find_contexts() lazily, in granule order, as lists made from
+        chunk_size files at a time, so that the contexts of a whole mission need never be held
+        at once. Overlaps are resolved within each list, so granules either side of the break
+        between two lists are both kept. The granules are not resolved ahead of build_task(),
+        which would fill the catalog's file_cache with the whole interval.
+        '''
+        delta_catalog = catalog_for(satellite)
+        files = []
+        last = None
+
+        for file in delta_catalog.iter_files('hirs', satellite, 'HIR1B', time_interval,
+                                             chunk_size):
+            if file.data_interval.left >= time_interval.left:
+                files.append(file)
+            if len(files) < chunk_size:
+                continue
+
+            contexts = [context for context in self.file_contexts(
+                            satellite, hirs2nc_delivery_id, produced, files, overlaps,
+                            prime=False)
+                        if context['granule'] != last]
+            files = []
+            if contexts:
+                last = contexts[-1]['granule']
+                yield contexts
+
+        contexts = [context for context in self.file_contexts(
+                        satellite, hirs2nc_delivery_id, produced, files, overlaps,
+                        prime=False)
+                    if context['granule'] != last]
+        if contexts:
+            yield contexts
+
+    def file_contexts(self, satellite, hirs2nc_delivery_id, produced, files, overlaps=None,
+                      prime=True):
+        '''
+        The contexts for the HIR1B files of satellite, in granule order, leaving out those
+        which overlaps drops as covered by the others, then those which produced has a product
+        for. With prime, the granules of the contexts are resolved ready for build_task().
+        '''
+        delta_catalog = catalog_for(satellite)
+
+        if overlaps is not None:
+            files = overlaps.resolve(files)
+        files = self.unproduced(satellite, hirs2nc_delivery_id, produced, files)
+
+        contexts = [{'granule': file.data_interval.left,
+                     'satellite': satellite,
+                     'hirs2nc_delivery_id': hirs2nc_delivery_id}
+                    for file in sorted(files, key=lambda file: file.data_interval.left)]
+
+        # Resolve the granule of every context in one pass, ready for build_task()
+        if prime:
+            delta_catalog.files_at('hirs', 'HIR1B',
+                                   [(satellite, context['granule']) for context in contexts])
+
+        return contexts
+
+    def unproduced(self, satellite, hirs2nc_delivery_id, produced, files):
+        '''
+        The files which the ProductIndex produced has no product for, counting the others as
+        skipped. All of the files are returned if produced is None.
+        '''
+        if produced is None:
+            return files
+
+        kept = [file for file in files
+                if not self.is_produced(satellite, hirs2nc_delivery_id, produced, file)]
+
+        if len(kept) < len(files):
+            LOG.info("Skipping {} of {} {} granules which have already been produced".format(
+                len(files) - len(kept), len(files), satellite))
+            produced.skipped += len(files) - len(kept)
+
+        return kept
+
+    def is_produced(self, satellite, hirs2nc_delivery_id, produced, file):
+        '''
+        Whether the ProductIndex produced has a product of the HIR1B file of satellite.
+        '''
+        return (file.name, hirs2nc_delivery_id,
+                self.satellite_version(satellite, file.data_interval.left)) in produced
 
     def satellite_version(self, satellite, granule):
 
@@ -77,25 +296,81 @@ class HIRS2NC(Computation):
             return 2
 
     @reraise_as(WorkflowNotReady, FileNotFound, prefix='NSS.HIRX')
+    @metered(context_arg=0)
     def build_task(self, context, task):
         '''
         Build up a set of inputs for a single context
         '''
-        global delta_catalog
-
         sensor = 'hirs'
         satellite =  context['satellite']
         file_type = 'HIR1B'
         granule = context['granule']
 
-        hirs_file = delta_catalog.file(sensor, satellite, file_type, granule)
+        delta_catalog = catalog_for(satellite)
+
+        with span('catalog'):
+            hirs_file = delta_catalog.file(sensor, satellite, file_type, granule)
 
         LOG.debug('data_interval = {}'.format(hirs_file.data_interval))
 
         task.input('HIR1B', hirs_file)
         task.option('data_interval', hirs_file.data_interval)
 
+    def hirs2nc_env(self, hirs2nc_delivery_id):
+        '''
+        The environment, python interpreter and hirs2nc script of the hirs2nc delivery.
+        '''
+        # Get the location of the binary package, and the required environment variables
+        with span('delivery'):
+            delivery, env = get_delivery(hirs2nc_delivery_id)
+        dist_root = pjoin(delivery.path, 'dist')
+        envroot = pjoin(dist_root, 'env')
+        LOG.debug(env)
+
+        # What is the path of the python interpreter
+        py_interp = "{}/bin/python".format(envroot)
+        LOG.debug("py_interp = '{}'".format(py_interp))
+
+        # Path of the hirs2nc binary
+        hirs2nc_bin = pjoin(envroot, 'bin', 'hirs2nc')
+
+        return env, py_interp, hirs2nc_bin
+
+    def convert(self, env, py_interp, hirs2nc_bin, hirs_version, input_file, output_file):
+        '''
+        Convert the flat HIRS file input_file to the NetCDF4 file output_file, returning the
+        exit status of hirs2nc.
+        '''
+        cmd = '{} {} {} {} {}'.format(
+                py_interp,
+                hirs2nc_bin,
+                hirs_version,
+                input_file,
+                output_file
+                )
+        try:
+            LOG.debug("cmd = \\\n\t{}".format(cmd.replace(' ',' \\\n\t')))
+            rc_hirs2nc = 0
+            with span('convert') as timing:
+                try:
+                    # Convert in a long-lived worker, which has hirs2nc and its modules loaded
+                    worker = get_worker(py_interp, hirs2nc_bin, env=env)
+                    rc_hirs2nc = worker.convert([hirs_version, input_file, output_file],
+                                                cwd=dirname(output_file))
+                    timing.add(**worker.last_usage)
+                except (IOError, OSError) as err:
+                    LOG.warning("{}, running the hirs2nc binary instead".format(err))
+                    runscript(cmd, requirements=[], env=env)
+            if rc_hirs2nc != 0:
+                raise CalledProcessError(rc_hirs2nc, cmd)
+        except CalledProcessError as err:
+            rc_hirs2nc = err.returncode
+            LOG.error("hirs2nc binary {} returned a value of {}".format(hirs2nc_bin, rc_hirs2nc))
+
+        return rc_hirs2nc
+
     @reraise_as(WorkflowNotReady, FileNotFound, prefix='NSS.HIRX')
+    @metered(context_arg=1)
     def run_task(self, inputs, context):
 
         LOG.debug("Running run_task()...")
@@ -108,28 +383,27 @@ class HIRS2NC(Computation):
         hirs2nc_delivery_id = context['hirs2nc_delivery_id']
         hirs_version = self.satellite_version(context['satellite'], context['granule'])
 
-        # Get the location of the binary package
-        delivery = delivered_software.lookup('hirs2nc', delivery_id=hirs2nc_delivery_id)
-        dist_root = pjoin(delivery.path, 'dist')
-        envroot = pjoin(dist_root, 'env')
-
-        # Get the required  environment variables
-        env = prepare_env([delivery])
-        LOG.debug(env)
-
-        # What is the path of the python interpreter
-        py_interp = "{}/bin/python".format(envroot)
-        LOG.debug("py_interp = '{}'".format(py_interp))
-
-        # Path of the hirs2nc binary
-        hirs2nc_bin = pjoin(envroot, 'bin', 'hirs2nc')
-
         # Where are we running the package
         work_dir = abspath(curdir)
         LOG.debug("working dir = {}".format(work_dir))
 
         input_file = inputs['HIR1B']
         output_file = pjoin(work_dir, basename('{}.nc'.format(inputs['HIR1B'])))
+
+        # Take the output of an earlier conversion of the same input, delivery and version
+        result_cache = get_result_cache()
+        if result_cache is not None:
+            with span('result_cache'):
+                cache_key = result_cache.key(input_file, hirs2nc_delivery_id, hirs_version)
+                cached = result_cache.get(cache_key, work_dir)
+            current().record['result_cache'] = 'miss' if cached is None else 'hit'
+            if cached is not None:
+                compressed, extra_attrs = cached
+                LOG.info("Using the cached output {} of {}".format(compressed, input_file))
+                return {'out': {'file': compressed, 'extra_attrs': extra_attrs}}
+
+        env, py_interp, hirs2nc_bin = self.hirs2nc_env(hirs2nc_delivery_id)
+
         LOG.debug("Input file = {}".format(input_file))
         LOG.debug("Output file = {}".format(output_file))
 
@@ -141,20 +415,9 @@ class HIRS2NC(Computation):
         LOG.debug("Inputs dir = {}".format(inputs_dir))
 
         # Convert the flat HIRS file to NetCDF4
-        cmd = '{} {} {} {} {}'.format(
-                py_interp,
-                hirs2nc_bin,
-                hirs_version,
-                input_file,
-                output_file
-                )
-        try:
-            LOG.debug("cmd = \\\n\t{}".format(cmd.replace(' ',' \\\n\t')))
-            rc_hirs2nc = 0
-            runscript(cmd, requirements=[], env=env)
-        except CalledProcessError as err:
-            rc_hirs2nc = err.returncode
-            LOG.error("hirs2nc binary {} returned a value of {}".format(hirs2nc_bin, rc_hirs2nc))
+        rc_hirs2nc = self.convert(env, py_interp, hirs2nc_bin, hirs_version, input_file,
+                                  output_file)
+        if rc_hirs2nc != 0:
             return rc_hirs2nc, []
 
         # The staging routine assumes that the output file is located in the work directory
@@ -165,4 +428,206 @@ class HIRS2NC(Computation):
         extra_attrs = {'begin_time': data_interval.left,
                        'end_time': data_interval.right}
 
-        return {'out': {'file': nc_compress(output), 'extra_attrs': extra_attrs}}
+        with span('compress'):
+            compressed = nc_compress(output)
+
+        if result_cache is not None:
+            try:
+                with span('result_cache'):
+                    result_cache.put(cache_key, compressed, extra_attrs)
+            except (IOError, OSError) as err:
+                LOG.warning("Unable to cache {}: {}".format(compressed, err))
+
+        return {'out': {'file': compressed, 'extra_attrs': extra_attrs}}
+
+class HIRS2NCBatch(HIRS2NC):
+    '''
+    Converts all of the granules which begin in a batch_length window in a single task. The
+    granule of a context is the start of its window, with the windows aligned to midnight for
+    batch lengths which divide a day. The output of the idx'th granule of a window is
+    'out{idx:02d}', for up to max_granules granules. With pipeline_compression, each output is
+    compressed in a background thread while the next granule converts. The task fails if any of
+    its granules fails to convert or compress.
+    '''
+
+    batch_length = timedelta(days=1)
+    max_granules = 32
+    pipeline_compression = True
+    outputs = ['out{:02d}'.format(idx) for idx in range(max_granules)]
+
+    def prefetch(self, input_files):
+        '''
+        Stage copies of the input files input_files, in the order given, in the background, if
+        there is a prefetcher.
+        '''
+        prefetcher = get_prefetcher()
+        if prefetcher is None or not input_files:
+            return
+
+        try:
+            prefetcher.schedule([(basename(input_file), input_file, os.path.getsize(input_file))
+                                 for input_file in input_files])
+        except OSError as err:
+            LOG.warning("Unable to prefetch the inputs of the batch: {}".format(err))
+
+    def staged(self, input_file):
+        '''
+        The staged copy of input_file, waiting for it if it is still being copied, or
+        input_file itself if there is none.
+        '''
+        prefetcher = get_prefetcher()
+        if prefetcher is None:
+            return input_file
+
+        with span('stage'):
+            staged = prefetcher.get(basename(input_file))
+
+        if staged is None:
+            return input_file
+
+        LOG.debug("Using the staged copy {} of {}".format(staged, input_file))
+        return staged
+
+    def compress(self, output, product, metrics=None):
+        '''
+        Compress the NetCDF4 file output, setting the 'file' of product to the compressed file.
+        The time taken is added to metrics, the record of the task.
+        '''
+        try:
+            with span('compress', metrics):
+                product['file'] = nc_compress(output)
+        except Exception:
+            LOG.error("Compressing {} failed:\n{}".format(output, traceback.format_exc()))
+
+    def window(self, granule):
+        '''
+        The batch window containing the time granule.
+        '''
+        offset = (granule - EPOCH).total_seconds() % self.batch_length.total_seconds()
+        left = granule - timedelta(seconds=offset)
+        return TimeInterval(left, left + self.batch_length - timedelta(seconds=1))
+
+    def file_contexts(self, satellite, hirs2nc_delivery_id, produced, files, overlaps=None,
+                      prime=True):
+        '''
+        The contexts of the batch windows of the HIR1B files of satellite, in order. Windows
+        whose granules all have a product in produced are left out. The granules of the others
+        which have one are only left out of their tasks if produced is also given to
+        set_products(). As batch_files() converts every other granule of a window, overlaps are
+        not resolved.
+        '''
+        files = self.unproduced(satellite, hirs2nc_delivery_id, produced, files)
+
+        windows = sorted(set(self.window(file.data_interval.left).left for file in files))
+
+        return [{'granule': window,
+                 'satellite': satellite,
+                 'hirs2nc_delivery_id': hirs2nc_delivery_id}
+                for window in windows]
+
+    def batch_files(self, satellite, granule, hirs2nc_delivery_id):
+        '''
+        The HIR1B files of satellite which begin in the batch window starting at granule,
+        leaving out those which the ProductIndex of set_products() has a product of for
+        hirs2nc_delivery_id.
+        '''
+        window = self.window(granule)
+        files = [file for file in catalog_for(satellite).files('hirs', satellite, 'HIR1B', window)
+                 if window.left <= file.data_interval.left <= window.right
+                 and not (products is not None and
+                          self.is_produced(satellite, hirs2nc_delivery_id, products, file))]
+        files.sort(key=lambda file: file.data_interval.left)
+
+        if not files:
+            raise WorkflowNotReady('No HIR1B files for {} in {}'.format(satellite, window))
+        if len(files) > self.max_granules:
+            raise ValueError('{} HIR1B files for {} in {}, more than the {} allowed'.format(
+                len(files), satellite, window, self.max_granules))
+
+        return files
+
+    @reraise_as(WorkflowNotReady, FileNotFound, prefix='NSS.HIRX')
+    @metered(context_arg=0)
+    def build_task(self, context, task):
+        '''
+        Build up the inputs for every granule of a batch
+        '''
+        with span('catalog'):
+            files = self.batch_files(context['satellite'], context['granule'],
+                                     context['hirs2nc_delivery_id'])
+
+        for idx, hirs_file in enumerate(files):
+            LOG.debug('data_interval = {}'.format(hirs_file.data_interval))
+            task.input('HIR1B{:02d}'.format(idx), hirs_file)
+
+        task.option('data_intervals', [hirs_file.data_interval for hirs_file in files])
+
+    @reraise_as(WorkflowNotReady, FileNotFound, prefix='NSS.HIRX')
+    @metered(context_arg=1)
+    def run_task(self, inputs, context):
+
+        LOG.debug("Running run_task()...")
+
+        for key in context.keys():
+            LOG.debug("run_task() context['{}'] = {}".format(key, context[key]))
+
+        satellite = context['satellite']
+        env, py_interp, hirs2nc_bin = self.hirs2nc_env(context['hirs2nc_delivery_id'])
+
+        # Where are we running the package
+        work_dir = abspath(curdir)
+        LOG.debug("working dir = {}".format(work_dir))
+
+        outputs = {}
+        rc_hirs2nc = 0
+        compressing = None
+
+        # Stage the inputs of the later granules of the batch while the first ones convert
+        self.prefetch([inputs['HIR1B{:02d}'.format(idx)]
+                       for idx in range(1, len(context['data_intervals']))])
+
+        for idx, data_interval in enumerate(context['data_intervals']):
+            input_file = self.staged(inputs['HIR1B{:02d}'.format(idx)])
+            output = basename('{}.nc'.format(input_file))
+            hirs_version = self.satellite_version(satellite, data_interval.left)
+            LOG.debug("Input file = {}".format(input_file))
+
+            # Convert the flat HIRS file to NetCDF4, carrying on with the rest of the batch if
+            # this granule fails, so that every failure of the batch is logged
+            rc = self.convert(env, py_interp, hirs2nc_bin, hirs_version, input_file,
+                              pjoin(work_dir, output))
+            if rc != 0:
+                rc_hirs2nc = rc
+                continue
+
+            extra_attrs = {'begin_time': data_interval.left,
+                           'end_time': data_interval.right}
+            product = outputs['out{:02d}'.format(idx)] = {'file': None,
+                                                          'extra_attrs': extra_attrs}
+
+            # Compress this granule while the next one converts, one compression at a time
+            if compressing is not None:
+                compressing.join()
+            if self.pipeline_compression:
+                compressing = threading.Thread(target=self.compress,
+                                               args=(output, product, current()))
+                compressing.start()
+            else:
+                self.compress(output, product)
+
+        if compressing is not None:
+            compressing.join()
+
+        # Drop the granules which failed to compress
+        for name, product in list(outputs.items()):
+            if product['file'] is None:
+                del outputs[name]
+
+        LOG.info("Converted {} of {} granules".format(len(outputs),
+                                                      len(context['data_intervals'])))
+
+        # Fail the whole task if any granule failed, so that flo runs the batch again
+        if len(outputs) < len(context['data_intervals']):
+            return rc_hirs2nc or 1, []
+
+        return outputs
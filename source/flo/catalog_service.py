@@ -0,0 +1,420 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+catalog_service.py
+
+ * DESCRIPTION: A catalog daemon which keeps the DeltaCatalogs of a node in one process and
+ answers queries on them over a Unix socket, so that submitters and workers on the node share a
+ single loaded index rather than each parsing the metadata lists. CatalogClient mirrors the
+ DeltaCatalog methods used by HIRS2NC, and is used by set_input_sources() when the input sources
+ give a 'catalog_socket', or HIRS2NC_CATALOG_SOCKET is set.
+
+ Requests and replies are single lines of JSON. A request names the input locations of the
+ catalog, the method and its arguments, with times as microseconds since 1970-01-01.
+
+ The daemon only serves the catalogs of the input locations listed in its --preload file, which
+ are loaded before it starts listening, and its socket is only open to its own user (or group,
+ with --socket-mode 660). A query for any other catalog is refused, and the client falls back to
+ a local catalog. Queries of a catalog run at the same time, waiting only while that catalog is
+ being refreshed, at most once every --refresh-interval seconds.
+
+ To run the daemon:
+    python -m flo.sw.hirs2nc.catalog_service -s /tmp/hirs2nc_catalog.sock --preload sources.json
+
+Copyright (c) 2018 University of Wisconsin Regents.
+Licensed under GNU GPLv3.
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import logging
+import argparse
+import threading
+import traceback
+from contextlib import contextmanager
+from itertools import islice
+
+try:
+    from socketserver import StreamRequestHandler, ThreadingMixIn, UnixStreamServer
+except ImportError:
+    from SocketServer import StreamRequestHandler, ThreadingMixIn, UnixStreamServer
+
+from flo.builder import WorkflowNotReady
+from timeutil import TimeInterval
+
+from flo.sw.hirs2nc.delta import (DeltaCatalog, DeltaFile, FileCache, from_usec, to_usec,
+                                  remove_duplicates)
+from flo.sw.hirs2nc.utils import setup_logging
+
+LOG = logging.getLogger(__name__)
+
+def encode_file(file):
+    return [file.name, to_usec(file.data_interval.left), to_usec(file.data_interval.right),
+            file.collection, file.path]
+
+def decode_file(fields):
+    name, left, right, collection, path = fields
+    return DeltaFile(name=name, data_interval=TimeInterval(from_usec(left), from_usec(right)),
+                     collection=collection, path=path)
+
+class CatalogRequestHandler(StreamRequestHandler):
+
+    def handle(self):
+        try:
+            for line in iter(self.rfile.readline, b''):
+                reply = self.server.answer(json.loads(line.decode('utf-8')))
+                self.wfile.write((json.dumps(reply) + '\n').encode('utf-8'))
+                self.wfile.flush()
+        except (IOError, socket.error) as err:
+            LOG.debug("Dropped a client connection: {}".format(err))
+
+class CatalogNotServed(Exception):
+    pass
+
+class CatalogLock(object):
+    '''
+    Lets any number of queries read a catalog at once, while a refresh has it to itself. A
+    waiting refresh goes ahead of the queries which arrive after it.
+    '''
+
+    def __init__(self):
+        self.condition = threading.Condition(threading.Lock())
+        self.readers = 0
+        self.writers = 0
+        self.writing = False
+
+    @contextmanager
+    def read(self):
+        with self.condition:
+            while self.writing or self.writers:
+                self.condition.wait()
+            self.readers += 1
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.readers -= 1
+                if not self.readers:
+                    self.condition.notify_all()
+
+    @contextmanager
+    def write(self):
+        with self.condition:
+            self.writers += 1
+            while self.writing or self.readers:
+                self.condition.wait()
+            self.writers -= 1
+            self.writing = True
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.writing = False
+                self.condition.notify_all()
+
+class ServedCatalog(object):
+    '''
+    A DeltaCatalog served by the daemon, with its lock and when it was last refreshed.
+    '''
+
+    def __init__(self, catalog):
+        self.catalog = catalog
+        self.lock = CatalogLock()
+        self.refreshing = threading.Lock()
+        self.refreshed = time.time()
+
+class CatalogServer(ThreadingMixIn, UnixStreamServer):
+    '''
+    Answers catalog queries on the Unix socket socket_path, which is created with the
+    permissions socket_mode. Only the catalogs added by serve() are answered for, created with
+    the DeltaCatalog options catalog_options, and refreshed at most every refresh_interval
+    seconds.
+    '''
+
+    daemon_threads = True
+    # Every worker of a node may connect at once
+    request_queue_size = 128
+
+    def __init__(self, socket_path, catalog_options=None, refresh_interval=60.,
+                 socket_mode=0o600):
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+
+        # Create the socket without a moment of wider permissions
+        umask = os.umask(0o777 & ~socket_mode)
+        try:
+            UnixStreamServer.__init__(self, socket_path, CatalogRequestHandler)
+        finally:
+            os.umask(umask)
+        os.chmod(socket_path, socket_mode)
+
+        self.catalog_options = dict(catalog_options or {}, refresh_interval=None)
+        self.refresh_interval = refresh_interval
+        self.catalogs = {}
+        self.requests = 0
+
+    def serve(self, input_locations):
+        '''
+        Load the catalog of input_locations, to be answered for. Must be called before the
+        server starts handling requests.
+        '''
+        from flo.sw.hirs2nc import catalog_key
+
+        LOG.info("Loading a catalog for {}".format(input_locations))
+        options = dict(self.catalog_options)
+        options.update(input_locations)
+        catalog = DeltaCatalog(**options)
+        for file_type in catalog.input_data:
+            catalog.check_file_index(file_type)
+
+        self.catalogs[catalog_key(input_locations)] = ServedCatalog(catalog)
+
+    def catalog(self, input_locations):
+        from flo.sw.hirs2nc import catalog_key
+
+        served = self.catalogs.get(catalog_key(input_locations))
+        if served is None:
+            raise CatalogNotServed("The catalog daemon does not serve {}".format(
+                input_locations))
+        return served
+
+    def refresh(self, served, force=False):
+        '''
+        Refresh the catalog served if it has not been for refresh_interval, or force is given,
+        returning the result of DeltaCatalog.refresh(). While one thread refreshes a catalog,
+        the others go on without.
+        '''
+        if not force and time.time() - served.refreshed < self.refresh_interval:
+            return {}
+        if not served.refreshing.acquire(False):
+            return {}
+        try:
+            with served.lock.write():
+                added = served.catalog.refresh()
+                served.refreshed = time.time()
+        finally:
+            served.refreshing.release()
+
+        if added:
+            LOG.info("Refreshed {}: {}".format(served.catalog.input_data, added))
+        return added
+
+    def answer(self, request):
+        '''
+        Return the reply to a single request.
+        '''
+        self.requests += 1
+        try:
+            served = self.catalog(request['catalog'])
+            method = getattr(self, 'answer_{}'.format(request['method']))
+            if request['method'] == 'refresh':
+                return {'result': method(served, *request['args'])}
+            self.refresh(served)
+            with served.lock.read():
+                return {'result': method(served.catalog, *request['args'])}
+        except WorkflowNotReady as err:
+            return {'error': 'WorkflowNotReady', 'message': str(err)}
+        except CatalogNotServed as err:
+            LOG.warning(str(err))
+            return {'error': 'CatalogNotServed', 'message': 'the catalog is not served'}
+        except Exception as err:
+            # The details stay in the daemon's log, as they may quote the files it reads
+            LOG.warning(traceback.format_exc())
+            return {'error': type(err).__name__, 'message': 'see the catalog daemon log'}
+
+    def answer_ping(self, catalog):
+        return self.requests
+
+    def answer_refresh(self, served, file_types):
+        return self.refresh(served)
+
+    def answer_file(self, catalog, sensor, sat, file_type, begin_time):
+        return encode_file(catalog.file(sensor, sat, file_type, from_usec(begin_time)))
+
+    def answer_files(self, catalog, sensor, sat, file_type, left, right):
+        interval = TimeInterval(from_usec(left), from_usec(right))
+        return [encode_file(file) for file in catalog.files(sensor, sat, file_type, interval)]
+
+    def answer_files_page(self, catalog, sensor, sat, file_type, left, right, after, count):
+        interval = TimeInterval(from_usec(left), from_usec(right))
+        after = from_usec(after) if after is not None else None
+        return [encode_file(file) for file in islice(
+            catalog.iter_files(sensor, sat, file_type, interval, count, after), count)]
+
+    def answer_join(self, catalog, sensor, sat, file_type, left, right, overlapping,
+                    bracketing):
+        interval = TimeInterval(from_usec(left), from_usec(right))
+        joined = catalog.join(sensor, sat, file_type, interval,
+                              [tuple(key) for key in overlapping],
+                              [tuple(key) for key in bracketing])
+        return [[encode_file(file),
+                 [[list(key), [encode_file(match) for match in files]]
+                  for key, files in matches.items()]]
+                for file, matches in joined]
+
+    def answer_files_at(self, catalog, sensor, file_type, keys):
+        found = catalog.files_at(sensor, file_type,
+                                 [(sat, from_usec(begin_time)) for sat, begin_time in keys])
+        return [[sat, to_usec(begin_time), encode_file(file)]
+                for (sat, begin_time), file in found.items()]
+
+class CatalogClient(object):
+    '''
+    A DeltaCatalog whose queries are answered by the catalog daemon listening on socket_path.
+    '''
+
+    def __init__(self, socket_path, timeout=300., **kwargs):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self.collection = kwargs['collection']
+        self.input_data = kwargs['input_data']
+        self.input_locations = kwargs
+        self.file_cache = FileCache()
+        self.lock = threading.Lock()
+        self.sock = None
+        self.reader = None
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.settimeout(self.timeout)
+            sock.connect(self.socket_path)
+        except Exception:
+            sock.close()
+            raise
+        self.sock, self.reader = sock, sock.makefile('rb')
+
+    def close(self):
+        if self.sock is not None:
+            self.reader.close()
+            self.sock.close()
+        self.sock = self.reader = None
+
+    def call(self, method, *args):
+        '''
+        Return the result of method on the daemon's catalog, reconnecting once if the
+        connection has dropped. Raises IOError if the daemon cannot be reached, or does not
+        serve the catalog.
+        '''
+        request = json.dumps({'catalog': self.input_locations, 'method': method,
+                              'args': args}) + '\n'
+
+        with self.lock:
+            for attempt in range(2):
+                try:
+                    if self.sock is None:
+                        self.connect()
+                    self.sock.sendall(request.encode('utf-8'))
+                    reply = self.reader.readline()
+                    if not reply:
+                        raise IOError("The catalog daemon closed the connection")
+                    break
+                except (IOError, OSError, socket.error) as err:
+                    self.close()
+                    if attempt:
+                        raise IOError("Unable to query the catalog daemon at {}: {}".format(
+                            self.socket_path, err))
+
+        reply = json.loads(reply.decode('utf-8'))
+        if 'error' in reply:
+            if reply['error'] == 'WorkflowNotReady':
+                raise WorkflowNotReady(reply['message'])
+            if reply['error'] == 'CatalogNotServed':
+                raise IOError("The catalog daemon at {} does not serve {}".format(
+                    self.socket_path, self.input_data))
+            raise RuntimeError("{}: {}".format(reply['error'], reply['message']))
+
+        return reply['result']
+
+    def ping(self):
+        return self.call('ping')
+
+    def refresh(self, file_types=None):
+        self.file_cache = FileCache()
+        return self.call('refresh', file_types)
+
+    def file(self, sensor, sat, file_type, begin_time):
+        key = (sensor, sat, file_type, begin_time)
+        file = self.file_cache.get(key)
+        if file is None:
+            file = decode_file(self.call('file', sensor, sat, file_type, to_usec(begin_time)))
+            self.file_cache[key] = file
+        return file
+
+    def files(self, sensor, sat, file_type, target_interval):
+        return [decode_file(fields) for fields in self.call(
+            'files', sensor, sat, file_type,
+            to_usec(target_interval.left), to_usec(target_interval.right))]
+
+    def iter_files(self, sensor, sat, file_type, target_interval, chunk_size=1000, after=None):
+        '''
+        Yield the files of iter_files() on the daemon's catalog, fetching chunk_size at a time.
+        '''
+        while True:
+            page = self.call('files_page', sensor, sat, file_type,
+                             to_usec(target_interval.left), to_usec(target_interval.right),
+                             to_usec(after) if after is not None else None, chunk_size)
+            for fields in page:
+                yield decode_file(fields)
+            if len(page) < chunk_size:
+                return
+            after = from_usec(page[-1][1])
+
+    def join(self, sensor, sat, file_type, target_interval, overlapping=(), bracketing=()):
+        return [(decode_file(fields), dict((tuple(key), [decode_file(match) for match in files])
+                                           for key, files in matches))
+                for fields, matches in self.call(
+                    'join', sensor, sat, file_type, to_usec(target_interval.left),
+                    to_usec(target_interval.right), overlapping, bracketing)]
+
+    def files_at(self, sensor, file_type, keys):
+        found = {}
+        for sat, begin_time, fields in self.call(
+                'files_at', sensor, file_type,
+                [(sat, to_usec(begin_time)) for sat, begin_time in keys]):
+            begin_time = from_usec(begin_time)
+            found[(sat, begin_time)] = file = decode_file(fields)
+            self.file_cache[(sensor, sat, file_type, begin_time)] = file
+        return found
+
+    def remove_duplicates(self, files):
+        return remove_duplicates(files)
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve HIRS catalog queries on a Unix socket.')
+    parser.add_argument('-s', '--socket', required=True, help='the Unix socket to listen on')
+    parser.add_argument('--socket-mode', type=lambda mode: int(mode, 8), default=0o600,
+                        help='the octal permissions of the socket (default: 600)')
+    parser.add_argument('--snapshot-dir', help='the directory of catalog snapshots to share')
+    parser.add_argument('--refresh-interval', type=float, default=60.,
+                        help='the least number of seconds between refreshes of a catalog')
+    parser.add_argument('--preload', required=True,
+                        help='a JSON file of the list of input locations to serve')
+    parser.add_argument('-v', '--verbosity', type=int, default=2)
+    args = parser.parse_args()
+
+    setup_logging(args.verbosity)
+
+    server = CatalogServer(args.socket, {'snapshot_dir': args.snapshot_dir},
+                           refresh_interval=args.refresh_interval, socket_mode=args.socket_mode)
+
+    with open(args.preload) as file_obj:
+        for input_locations in json.load(file_obj):
+            server.serve(input_locations)
+
+    LOG.info("Serving {} catalogs on {}".format(len(server.catalogs), args.socket))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.unlink(args.socket)
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
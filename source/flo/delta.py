@@ -1,11 +1,25 @@
 import os
+import sys
+import time
+import codecs
 import logging
+import threading
 import traceback
-from collections import namedtuple
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict, namedtuple
+from heapq import heappop, heappush
+from itertools import compress
+from operator import eq, itemgetter, le, lt
 
 from flo.builder import WorkflowNotReady
 from timeutil import TimeInterval, datetime, timedelta
 
+from flo.sw.hirs2nc.metrics import span
+from flo.sw.hirs2nc.scan import DirectoryScan
+from flo.sw.hirs2nc.snapshot import (INT64, source_key, snapshot_path, read_snapshot,
+                                     write_snapshot)
+
 # every module should have a LOG object
 LOG = logging.getLogger(__name__)
 
@@ -24,73 +38,293 @@ class DeltaCatalog(object):
 
         self.collection = kwargs['collection']
         self.input_data = kwargs['input_data']
-        self.file_data = {}
+        # Optional directory of parsed metadata snapshots shared between processes
+        self.snapshot_dir = kwargs.get('snapshot_dir')
+        # Optional number of seconds after which searches first refresh() their file type
+        self.refresh_interval = kwargs.get('refresh_interval')
+        # Number of directories listed at once for input_data which are archive directories
+        self.scan_workers = kwargs.get('scan_workers', 8)
+        self.file_index = {}
         self.indexed_file_types = {}
+        # The size and mtime of each loaded metadata file, the index keys it provided, its
+        # (inode, offset) read up to, and when it was last refreshed
+        self.source_keys = {}
+        self.file_type_keys = {}
+        self.source_positions = {}
+        self.refresh_times = {}
+        # Granules resolved by file() or files_at(), keyed by (sensor, sat, file_type, begin_time)
+        self.file_cache = FileCache()
+        # The DirectoryScan of each file type whose input_data is an archive directory
+        self.scans = {}
 
     def process_metadata(self, file_type):
         '''
-        Run through the *.out file and create a nested dictionary containing the
-        the required metadata for the files of each file_type.
+        Run through the *.out file and create the time indices holding the required
+        metadata for the files of each sensor, satellite and file_type. If snapshot_dir
+        is set, the indices are mapped from a current snapshot of the *.out file instead,
+        or written to one after parsing. If the input_data of file_type is a directory
+        rather than a *.out file, the indices are built by process_directory().
         '''
         LOG.debug("Reading the metadata file...")
 
         metadata_file = self.input_data[file_type]
         LOG.debug("For file_type = '{}', metadata_file = {}".format(file_type,metadata_file))
 
-        # Open the metadata file and read each line, splitting into the required 
-        # metadata for each file.
-        with open(metadata_file) as metadata:
-            for line in metadata:
-                (size, mod_time, begin_time, end_time, sensor, sat, file_type, file_system,
-                 relative_path) = line.split(',')
-                begin_time = datetime.fromtimestamp(float(begin_time))
-                end_time = datetime.fromtimestamp(float(end_time))
-                relative_path = relative_path.split()[0]
-                name = os.path.basename(relative_path)
+        if os.path.isdir(metadata_file):
+            self.process_directory(file_type)
+            return
+
+        inode = os.stat(metadata_file).st_ino
+        metadata_key = source_key(metadata_file)
 
-                if sensor not in self.file_data:
-                    self.file_data[sensor] = {}
+        tables = None
+        snapshot = None
+        if self.snapshot_dir is not None:
+            snapshot = snapshot_path(self.snapshot_dir, metadata_file)
+            with span('catalog_snapshot'):
+                tables = read_snapshot(snapshot, metadata_key)
 
-                if sat not in self.file_data[sensor]:
-                    self.file_data[sensor][sat] = {}
+        if tables is not None:
+            # Snapshots are only written of whole files
+            offset = metadata_key[0]
+            for key, columns in tables.items():
+                self.file_index[key] = FileIndex(**columns)
+        else:
+            # Parse the metadata file in bulk, and rebuild the time indices of everything it
+            # held, leaving any partially written last line for the next refresh.
+            with span('catalog_parse'), open(metadata_file, 'rb') as metadata:
+                inode = os.fstat(metadata.fileno()).st_ino
+                offset = complete_length(metadata)
+                tables = parse_metadata(LimitedReader(metadata, offset))
 
-                if file_type not in self.file_data[sensor][sat]:
-                    self.file_data[sensor][sat][file_type] = {}
+            for key, columns in tables.items():
+                self.file_index[key] = FileIndex.from_columns(**columns)
 
-                if name not in self.file_data[sensor][sat][file_type]:
+            if snapshot is not None and offset == metadata_key[0]:
+                try:
+                    write_snapshot(snapshot, metadata_key,
+                                   dict((key, self.file_index[key].columns()) for key in tables))
+                except (IOError, OSError) as err:
+                    LOG.warning("Unable to write catalog snapshot {}: {}".format(snapshot, err))
 
-                    if end_time < begin_time:
-                        LOG.warning("{}: End time {} is before begin time {}, adding a day.".format(
-                        name, end_time, begin_time))
-                        end_time += timedelta(days=1)
+        self.file_cache = FileCache()
+        self.source_keys[file_type] = metadata_key
+        self.file_type_keys[file_type] = set(tables)
+        self.source_positions[file_type] = (inode, offset)
+        self.refresh_times[file_type] = time.time()
+        self.indexed_file_types[file_type] = 1
 
-                    self.file_data[sensor][sat][file_type][name] = {
-                        'data_interval': TimeInterval(begin_time, end_time),
-                        'name': name,
-                        'path': relative_path}
 
+    def process_directory(self, file_type, rescan=True):
+        '''
+        Create the time indices of the files of file_type from a scan of the archive directory
+        given as its input_data, with the times taken from the file names. As for the metadata
+        lists, the UTC times of the names are converted to local time, and the paths are
+        relative to the archive directory. Only directories which have changed since the last
+        scan are listed again, and with rescan False the last scan is used as it is. Returns
+        the number of files.
+        '''
+        if file_type not in self.scans:
+            self.scans[file_type] = DirectoryScan(self.input_data[file_type],
+                                                  workers=self.scan_workers)
+
+        with span('catalog_scan'):
+            if rescan:
+                self.scans[file_type].scan()
+            tables = self.scans[file_type].tables(file_type)
+
+        offsets = {}
+        for columns in tables.values():
+            for name in ('begin', 'end'):
+                columns[name] = array(INT64, timestamps_to_usec(
+                    [usec / 1000000. for usec in columns[name]], offsets))
+
+        self.forget(file_type)
+        for key, columns in tables.items():
+            self.file_index[key] = FileIndex.from_columns(**columns)
+
+        self.file_type_keys[file_type] = set(tables)
+        self.refresh_times[file_type] = time.time()
         self.indexed_file_types[file_type] = 1
 
+        return sum(len(self.file_index[key]) for key in tables)
 
     def check_file_index(self, file_type):
 
         if file_type not in self.indexed_file_types:
             self.process_metadata(file_type)
 
+    def forget(self, file_type):
+        '''
+        Drop the indices loaded from the metadata file of file_type, so that it is reloaded
+        on the next search.
+        '''
+        for key in self.file_type_keys.pop(file_type, ()):
+            self.file_index.pop(key, None)
+        self.file_cache = FileCache()
+        for loaded in (self.source_keys, self.source_positions, self.refresh_times,
+                       self.indexed_file_types):
+            loaded.pop(file_type, None)
+
+    def refresh(self, file_types=None):
+        '''
+        Bring the indices of the loaded metadata files up to date. Lines appended to a file
+        since it was last read are ingested into the existing indices, while a file which has
+        been rotated (has a new inode), truncated or rewritten is reloaded in full. Returns a
+        dict of the number of files ingested for each file type which changed, which for a
+        reloaded file is all of them. An archive directory is scanned again, and its indices
+        rebuilt if any of its directories have changed.
+        '''
+        added = {}
+        for file_type in list(self.indexed_file_types if file_types is None else file_types):
+            if file_type in self.scans:
+                self.refresh_times[file_type] = time.time()
+                if self.scans[file_type].scan():
+                    added[file_type] = self.process_directory(file_type, rescan=False)
+                continue
+
+            if file_type not in self.source_positions:
+                continue
+
+            metadata_file = self.input_data[file_type]
+            self.refresh_times[file_type] = time.time()
+            try:
+                stat = os.stat(metadata_file)
+            except OSError as err:
+                LOG.warning("Unable to refresh {}: {}".format(metadata_file, err))
+                continue
+
+            inode, offset = self.source_positions[file_type]
+            if stat.st_ino == inode and stat.st_size > offset:
+                added[file_type] = self.ingest(file_type, offset)
+            elif (stat.st_ino != inode or stat.st_size < offset
+                  or source_key(metadata_file) != self.source_keys[file_type]):
+                LOG.info("Metadata file {} has been replaced, reloading it.".format(metadata_file))
+                self.forget(file_type)
+                self.process_metadata(file_type)
+                added[file_type] = sum(len(self.file_index[key])
+                                       for key in self.file_type_keys[file_type])
+
+        return added
+
+    def ingest(self, file_type, offset):
+        '''
+        Add the complete lines appended to the metadata file of file_type after offset to
+        the indices, returning the number of new files.
+        '''
+        metadata_file = self.input_data[file_type]
+
+        with open(metadata_file, 'rb') as metadata:
+            inode = os.fstat(metadata.fileno()).st_ino
+            metadata.seek(offset)
+            tail = metadata.read()
+
+        # Leave any partially written last line for the next refresh.
+        tail = tail[:tail.rfind(b'\n') + 1]
+        if not tail:
+            return 0
+
+        with span('catalog_ingest'):
+            if sys.version_info[0] < 3:
+                from StringIO import StringIO
+                tables = parse_metadata(StringIO(tail))
+            else:
+                from io import StringIO
+                tables = parse_metadata(StringIO(tail.decode('utf-8')))
+
+        added = 0
+        for key, columns in tables.items():
+            if key in self.file_index:
+                added += self.file_index[key].extend(**columns)
+            else:
+                self.file_index[key] = FileIndex.from_columns(**columns)
+                added += len(self.file_index[key])
+            self.file_type_keys[file_type].add(key)
+
+        if added:
+            self.file_cache = FileCache()
+
+        offset += len(tail)
+        self.source_positions[file_type] = (inode, offset)
+        self.source_keys[file_type] = metadata_key = source_key(metadata_file)
+        LOG.debug("Ingested {} new files from {}".format(added, metadata_file))
+
+        # Only a snapshot of the whole file is of use to other processes.
+        if self.snapshot_dir is not None and metadata_key[0] == offset:
+            try:
+                write_snapshot(snapshot_path(self.snapshot_dir, metadata_file), metadata_key,
+                               dict((key, self.file_index[key].columns())
+                                    for key in self.file_type_keys[file_type]))
+            except (IOError, OSError) as err:
+                LOG.warning("Unable to write catalog snapshot for {}: {}".format(metadata_file, err))
+
+        return added
+
+    def index(self, sensor, sat, file_type, begin_time):
+        '''
+        Return the time index for the files of a sensor, satellite and file type.
+        '''
+        # Loading files of type file_type before searching
+        self.check_file_index(file_type)
+
+        if (self.refresh_interval is not None and
+                time.time() - self.refresh_times[file_type] > self.refresh_interval):
+            self.refresh([file_type])
+
+        key = (sensor, sat, file_type)
+        if key not in self.file_index:
+            raise WorkflowNotReady('No files for {} {} {} {}'.format(sensor, sat, file_type,
+                                                                      begin_time))
+
+        return self.file_index[key]
 
     def file(self, sensor, sat, file_type, begin_time):
 
-        file_list = self.files(sensor, sat, file_type, TimeInterval(begin_time, begin_time))
-        LOG.debug("file_list: {}".format(file_list))
+        key = (sensor, sat, file_type, begin_time)
+        file = self.file_cache.get(key)
+        if file is not None:
+            return file
+
+        file_index = self.index(sensor, sat, file_type, begin_time)
 
-        # Making sure we have the right begin time as some inputs overlap
-        for (i, file) in enumerate(file_list):
-            if file.data_interval.left == begin_time:
-                return file_list[i]
+        # Only files with exactly the right begin time are candidates, as some inputs overlap
+        rows = file_index.unique(file_index.starting_at(begin_time))
+        LOG.debug("rows: {}".format(rows))
+
+        if rows:
+            file = self.file_info(file_index.line(rows[0]), file_type)
+            self.file_cache[key] = file
+            return file
 
         raise WorkflowNotReady('No files for {} {} {} {}'.format(sensor, sat, file_type,
                                                                   begin_time))
 
+    def files_at(self, sensor, file_type, keys):
+        '''
+        Look up the files for many granules at once, where keys is a sequence of
+        (sat, begin_time) pairs. The begin times of each satellite are sorted and matched
+        against its index in a single forward pass. Returns a dict of the DeltaFile for each
+        key that has one, as file() would return, and caches them for file().
+        '''
+        sat_keys = {}
+        for sat, begin_time in keys:
+            sat_keys.setdefault(sat, set()).add(begin_time)
+
+        found = {}
+        for sat, begin_times in sat_keys.items():
+            begin_times = sorted(begin_times)
+            file_index = self.index(sensor, sat, file_type, begin_times[0])
+
+            begin_usecs = list(map(to_usec, begin_times))
+            for begin_time, rows in zip(begin_times, file_index.rows_at_many(begin_usecs)):
+                rows = file_index.unique(rows)
+                if rows:
+                    file = self.file_info(file_index.line(rows[0]), file_type)
+                    found[(sat, begin_time)] = file
+                    self.file_cache[(sensor, sat, file_type, begin_time)] = file
+
+        return found
+
     def files(self, sensor, sat, file_type, target_interval):
 
         LOG.debug('sensor = {}'.format(sensor))
@@ -98,70 +332,152 @@ class DeltaCatalog(object):
         LOG.debug('file_type = {}'.format(file_type))
         LOG.debug('target_interval = {}'.format(target_interval))
 
-        # Loading files of type file_type before searching
-        self.check_file_index(file_type)
+        file_index = self.index(sensor, sat, file_type, target_interval.left)
 
-        # Get the dict of the file metadata for the correct sensor, satellite and 
-        # file type...
-        if file_type not in self.file_data[sensor][sat]:
-            raise WorkflowNotReady('No files for {} {} {} {}'.format(sensor, sat, file_type,
-                                                                      target_interval.left))
-        else:
-            file_search = self.file_data[sensor][sat][file_type]
-            fs_keys = file_search.keys()
-            fs_keys.sort()
-            #print('file_search[{}] = {}'.format(fs_keys[0],file_search[fs_keys[0]]))
-            #print('file_search = {}'.format(file_search))
+        # Create a list of all of the files which overlap the desired time interval, leaving
+        # out the duplicate granules.
+        lines = [file_index.line(row)
+                 for row in file_index.unique(file_index.overlapping(target_interval))]
+        files = [self.file_info(line, file_type)
+                 for line in lines
+                 if target_interval.overlaps(line['data_interval'])]
 
+        return sorted(files, key=lambda x: x.name)
 
-        # Create a list of all of the files which overlap the desired time interval.
-        files = [self.file_info(file_search[name], file_type)
-                 for name in fs_keys
-                 if target_interval.overlaps(file_search[name]['data_interval'])]
+    def iter_files(self, sensor, sat, file_type, target_interval, chunk_size=1000, after=None):
+        '''
+        Yield the files of files() lazily, in begin time order rather than by name, resolving
+        chunk_size rows of the index at a time. Each chunk is found afresh from the begin time
+        reached, so a refresh() between chunks is picked up. With after, only the files which
+        begin after it are yielded.
+        '''
+        cursor = to_usec(after) if after is not None else None
 
-        # Remove any duplicates from the file list.
-        return self.remove_duplicates(files)
+        while True:
+            file_index = self.index(sensor, sat, file_type, target_interval.left)
+            first, last = file_index.overlapping_bounds(target_interval)
+            if cursor is not None:
+                first = max(first, bisect_right(file_index.begin, cursor))
+            if first >= last:
+                return
 
-    def remove_duplicates(self, files):
+            # Never split the rows of a granule, as only one of them is kept
+            end = min(first + chunk_size, last)
+            end = bisect_right(file_index.begin, file_index.begin[end - 1])
+            for row in file_index.unique(range(first, end)):
+                line = file_index.line(row)
+                if target_interval.overlaps(line['data_interval']):
+                    yield self.file_info(line, file_type)
 
-        prune_files = {}
+            cursor = file_index.begin[end - 1]
 
-        for file in files:
-            # This granule start time has already been encountered...
-            if file.data_interval.left in prune_files:
+    def join(self, sensor, sat, file_type, target_interval, overlapping=(), bracketing=()):
+        '''
+        Match each of the files of file_type which overlap target_interval with the files of
+        other types, in a single sweep along each of the indices rather than a search per file.
+        overlapping and bracketing are sequences of (sensor, sat, file_type) keys:
 
-                old_file = prune_files[file.data_interval.left]
-                new_file = file
+            overlapping: the files of the key which overlap the file, as files() would find
+                         for its data_interval, such as the PTMSX files of a granule.
+            bracketing:  the last file of the key which begins at or before the file, those
+                         beginning during it, and the first beginning at or after its end, such
+                         as the CFSR analyses bracketing a granule.
 
-                # Determine the durations of the old and new granules...
-                old_duration = old_file.data_interval.duration
-                new_duration = new_file.data_interval.duration
+        Returns a list in begin time order of (file, matches) pairs, where matches holds the
+        list of the matching files of each key, in begin time order.
+        '''
+        joined = [(file, {})
+                  for file in self.iter_files(sensor, sat, file_type, target_interval)]
+        if not joined:
+            return joined
 
-                # Put new granule with this start time if its duration is longer
-                if new_duration > old_duration:
-                    print 'For start time ({}), replacing the end time ({}) ({}) with new end time ({}) ({}).'.format(
-                            old_file.data_interval.left,
-                            old_file.data_interval.right,old_file.name,
-                            new_file.data_interval.right,new_file.name)
+        lefts = [to_usec(file.data_interval.left) for file, matches in joined]
+        rights = [to_usec(file.data_interval.right) for file, matches in joined]
 
-                    prune_files[file.data_interval.left] = new_file
-                else:
-                    print 'For start time ({}), retaining the end time ({}) ({}), discarding the new end time ({}) ({}).'.format(
-                            old_file.data_interval.left,
-                            old_file.data_interval.right,old_file.name,
-                            new_file.data_interval.right,new_file.name)
-            else:
-                # Haven't seen this granule start time before, add to the dict...
-                prune_files[file.data_interval.left] = file
+        for key in overlapping:
+            self.join_overlapping(key, joined, lefts, rights)
+        for key in bracketing:
+            self.join_bracketing(key, joined, lefts, rights)
+
+        return joined
+
+    def join_overlapping(self, key, joined, lefts, rights):
+        '''
+        Add the files of key overlapping each of the joined files, whose begin and end times,
+        in begin time order, are lefts and rights.
+        '''
+        file_index = self.index(key[0], key[1], key[2], from_usec(lefts[0]))
+        begin, end = file_index.begin, file_index.end
 
-        # Sort the list of dbase entries based on filename.
-        delta_list = prune_files.values()
-        delta_key = lambda x: (x.name)
-        delta_list_sorted = sorted(delta_list,key=delta_key)
+        first, last = file_index.overlapping_bounds(
+            TimeInterval(from_usec(lefts[0]), from_usec(max(rights))))
+        rows = file_index.unique(range(first, last))
+
+        # The rows which began before the current file ends, and have not ended before it
+        # begins, keyed by their end times. As the files begin in order, a row which ends
+        # before one of them begins can not overlap any later one.
+        active = []
+        pos = 0
+        for (file, matches), left, right in zip(joined, lefts, rights):
+            while pos < len(rows) and begin[rows[pos]] <= right:
+                heappush(active, (end[rows[pos]], rows[pos]))
+                pos += 1
+            while active and active[0][0] < left:
+                heappop(active)
+
+            lines = map(file_index.line, sorted(row for end_usec, row in active
+                                                if begin[row] <= right))
+            matches[key] = [self.file_info(line, key[2]) for line in lines
+                            if file.data_interval.overlaps(line['data_interval'])]
+
+    def join_bracketing(self, key, joined, lefts, rights):
+        '''
+        Add the files of key bracketing each of the joined files, whose begin and end times,
+        in begin time order, are lefts and rights.
+        '''
+        file_index = self.index(key[0], key[1], key[2], from_usec(lefts[0]))
+        begin = file_index.begin
+
+        # From the rows of the last time at or before the begin of the first file, all of them
+        # as duplicate resolution may keep any, to those of the first time at or after the end
+        # of the last
+        first = max(0, bisect_right(begin, lefts[0]) - 1)
+        if first < len(file_index):
+            first = bisect_left(begin, begin[first])
+        last = bisect_left(begin, max(rights))
+        if last < len(file_index):
+            last = bisect_right(begin, begin[last])
+        rows = file_index.unique(range(first, last))
+        if not rows:
+            for file, matches in joined:
+                matches[key] = []
+            return
+
+        pos = 0
+        for (file, matches), left, right in zip(joined, lefts, rights):
+            while pos + 1 < len(rows) and begin[rows[pos + 1]] <= left:
+                pos += 1
+
+            bracket = []
+            for row in rows[pos:]:
+                bracket.append(row)
+                if begin[row] >= right:
+                    break
+
+            matches[key] = [self.file_info(file_index.line(row), key[2]) for row in bracket]
+
+    def remove_duplicates(self, files):
+        '''
+        Keep one file per granule start time, as remove_duplicates() below.
+        '''
+        return remove_duplicates(files)
 
-        #return prune_files.values()
-        return delta_list_sorted
 
+    def resolve_overlaps(self, files, policy='longest', threshold=0.9):
+        '''
+        Drop the files mostly covered by others, as OverlapResolver below.
+        '''
+        return OverlapResolver(policy, threshold).resolve(files)
 
     def file_info(self, line, file_type):
 
@@ -173,5 +489,561 @@ class DeltaCatalog(object):
                          collection=self.collection[file_type],
                          path=line['path'])
 
+
+def remove_duplicates(files):
+    '''
+    Keep one file per granule start time, the one of longest duration, with ties going
+    to the first name. Returns the kept files sorted by name.
+    '''
+    prune_files = {}
+    for file in sorted(files, key=lambda x: x.name):
+        old_file = prune_files.get(file.data_interval.left)
+        if old_file is None or file.data_interval.duration > old_file.data_interval.duration:
+            prune_files[file.data_interval.left] = file
+
+    if len(prune_files) < len(files):
+        LOG.debug("Discarded {} duplicate granules".format(len(files) - len(prune_files)))
+
+    # Sort the list of dbase entries based on filename.
+    return sorted(prune_files.values(), key=lambda x: x.name)
+
+
+class OverlapResolver(object):
+    '''
+    Drops the granules which are mostly covered by others, such as the overlapping orbit files
+    of an archive which begin a few minutes apart. The granules are considered longest first,
+    and each is kept unless those already kept cover at least threshold of its duration:
+
+        'longest':  covered by a single longer granule, so that the longest of a pair wins.
+        'coverage': covered by the union of the granules kept around it.
+
+    A threshold below 1 accepts losing the rest of a dropped granule's scan lines. The numbers
+    of granules and seconds of data seen and dropped are kept in counts, for report().
+    '''
+
+    policies = ('longest', 'coverage')
+
+    def __init__(self, policy='longest', threshold=0.9):
+        if policy not in self.policies:
+            raise ValueError("Unknown overlap policy {}, not one of {}".format(
+                policy, ', '.join(self.policies)))
+        self.policy = policy
+        self.threshold = threshold
+        self.counts = {'granules': 0, 'dropped': 0, 'seconds': 0., 'dropped_seconds': 0.}
+
+    def covered(self, left, right, kept_begins, kept, max_duration):
+        '''
+        The microseconds of [left, right] covered by the kept (begin, end) intervals, sorted
+        by their begin times kept_begins, none of which is longer than max_duration.
+        '''
+        first = bisect_right(kept_begins, left - max_duration)
+        last = bisect_left(kept_begins, right)
+        spans = [(max(begin, left), min(end, right)) for begin, end in kept[first:last]
+                 if end > left]
+
+        if self.policy == 'longest':
+            return max([end - begin for begin, end in spans] or [0])
+
+        total, reached = 0, left
+        for begin, end in spans:
+            if end > reached:
+                total += end - max(begin, reached)
+                reached = end
+        return total
+
+    def resolve(self, files):
+        '''
+        Return the files which are kept, in their original order.
+        '''
+        intervals = [(to_usec(file.data_interval.left), to_usec(file.data_interval.right))
+                     for file in files]
+        order = sorted(range(len(files)), key=lambda idx: (
+            intervals[idx][0] - intervals[idx][1], intervals[idx][0], files[idx].name))
+
+        # The kept intervals in begin time order, and the longest of them
+        kept_begins, kept = [], []
+        max_duration = 0
+        dropped = set()
+
+        for idx in order:
+            left, right = intervals[idx]
+            duration = right - left
+            covered = self.covered(left, right, kept_begins, kept, max_duration)
+            if kept and covered >= self.threshold * duration and (
+                    duration > 0 or any(begin <= left and right <= end
+                                        for begin, end in kept)):
+                dropped.add(idx)
+                continue
+            pos = bisect_right(kept_begins, left)
+            kept_begins.insert(pos, left)
+            kept.insert(pos, (left, right))
+            max_duration = max(max_duration, duration)
+
+        self.counts['granules'] += len(files)
+        self.counts['dropped'] += len(dropped)
+        self.counts['seconds'] += sum(right - left for left, right in intervals) / 1e6
+        self.counts['dropped_seconds'] += sum(intervals[idx][1] - intervals[idx][0]
+                                              for idx in dropped) / 1e6
+
+        if dropped:
+            LOG.debug("Dropped {} of {} granules covered by others".format(
+                len(dropped), len(files)))
+
+        return [file for idx, file in enumerate(files) if idx not in dropped]
+
+    def report(self):
+        '''
+        A summary of the granules dropped, and the share of the data they held.
+        '''
+        counts = self.counts
+        return ("Dropped {} of {} overlapping granules ({} policy, threshold {}), "
+                "{:.1f} of {:.1f} hours of data ({:.1f}% of the conversion work)".format(
+                    counts['dropped'], counts['granules'], self.policy, self.threshold,
+                    counts['dropped_seconds'] / 3600., counts['seconds'] / 3600.,
+                    100. * counts['dropped_seconds'] / counts['seconds']
+                    if counts['seconds'] else 0.))
+
+
+EPOCH = datetime(1970, 1, 1)
+DAY_USEC = 86400 * 1000000
+
+# Number of bytes of the metadata file to split into columns at a time
+CHUNK_SIZE = 1024 * 1024
+
+# Number of granules kept by the file_cache of a catalog
+FILE_CACHE_SIZE = 20000
+
+
+def to_usec(time_obj):
+    '''
+    Convert a (naive) datetime to integer microseconds since EPOCH.
+    '''
+    delta = time_obj - EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+
+
+def from_usec(usec):
+    '''
+    Convert integer microseconds since EPOCH back to a datetime.
+    '''
+    return EPOCH + timedelta(microseconds=usec)
+
+
+def timestamps_to_usec(timestamps, offsets):
+    '''
+    Convert a sequence of POSIX timestamp strings to local time microseconds since EPOCH,
+    matching datetime.fromtimestamp(). The UTC offset of the local timezone is computed once
+    per day and cached in offsets, falling back to fromtimestamp() itself on the days when
+    the offset changes.
+    '''
+    timestamps = list(map(float, timestamps))
+    # Rounding half up, as HIRS data all postdates EPOCH.
+    usec = [int(timestamp * 1.e6 + 0.5) for timestamp in timestamps]
+
+    days = set(map(int, map((1. / 86400.).__mul__, timestamps)))
+    for day in days.difference(offsets):
+        start = to_usec(datetime.fromtimestamp(day * 86400)) - day * DAY_USEC
+        end = to_usec(datetime.fromtimestamp(day * 86400 + 86399)) - (day * 86400 + 86399) * 1000000
+        offsets[day] = start if start == end else None
+
+    day_offsets = set(offsets[day] for day in days)
+    if len(day_offsets) == 1 and None not in day_offsets:
+        # A single offset applies to every timestamp, as it does all year round in UTC.
+        offset = day_offsets.pop()
+        return list(map(offset.__add__, usec)) if offset else usec
+
+    for row, timestamp in enumerate(timestamps):
+        offset = offsets[int(timestamp / 86400.)]
+        if offset is None:
+            usec[row] = to_usec(datetime.fromtimestamp(timestamp))
+        else:
+            usec[row] += offset
+
+    return usec
+
+
+def complete_length(file_obj, block_size=65536):
+    '''
+    The length of the binary file file_obj up to the end of its last complete line.
+    '''
+    end = os.fstat(file_obj.fileno()).st_size
+    while end > 0:
+        start = max(0, end - block_size)
+        file_obj.seek(start)
+        block = file_obj.read(end - start)
+        if b'\n' in block:
+            return start + block.rfind(b'\n') + 1
+        end = start
+    return 0
+
+
+class LimitedReader(object):
+    '''
+    Reads the binary file file_obj from its start as text, up to limit bytes.
+    '''
+
+    def __init__(self, file_obj, limit):
+        self.file_obj = file_obj
+        self.remaining = limit
+        self.decoder = codecs.getincrementaldecoder('utf-8')()
+        file_obj.seek(0)
+
+    def read(self, size):
+        data = self.file_obj.read(min(size, self.remaining))
+        self.remaining -= len(data)
+        if isinstance(data, str):
+            return data
+        return self.decoder.decode(data, final=not data)
+
+
+def parse_metadata(metadata, chunk_size=CHUNK_SIZE):
+    '''
+    Parse the nine column metadata lines of a *.out file, returning a dict of the columns
+    accepted by FileIndex.from_columns() for each (sensor, sat, file_type) in the file.
+
+    The file is read in chunks of roughly chunk_size bytes. Each chunk is split into a flat
+    list of fields in one go, and its columns are taken as slices of that list, so that the
+    conversions are made a column at a time. As before, only the first entry for each file
+    name is kept, and end times before their begin time are moved forward a day.
+    '''
+    tables = {}
+    seen_names = {}
+    offsets = {}
+    days_added = 0
+    remainder = ''
+
+    while True:
+        chunk = metadata.read(chunk_size)
+        if chunk:
+            # Carry any partial last line over to the next chunk.
+            chunk = remainder + chunk
+            last_line = chunk.rfind('\n') + 1
+            chunk, remainder = chunk[:last_line], chunk[last_line:]
+            if not chunk:
+                continue
+        elif remainder.strip():
+            chunk, remainder = remainder + '\n', ''
+        else:
+            break
+
+        # Blank lines and stray whitespace are rare, so only take them out when present.
+        clean = '\r' not in chunk and '\n\n' not in chunk and not chunk.startswith('\n')
+        if clean:
+            line_count = chunk.count('\n')
+            fields = chunk[:-1].replace('\n', ',').split(',')
+        else:
+            lines = [line for line in chunk.splitlines() if line.strip()]
+            line_count = len(lines)
+            fields = ','.join(lines).split(',')
+
+        if len(fields) != 9 * line_count:
+            bad_lines = [line for line in chunk.splitlines() if line.strip() and line.count(',') != 8]
+            raise ValueError("Malformed metadata line in {}: {}".format(
+                getattr(metadata, 'name', metadata), bad_lines[0] if bad_lines else chunk[:80]))
+
+        sensors, sats, file_types = fields[4::9], fields[5::9], fields[6::9]
+        relative_paths = fields[8::9]
+        if not (clean and ' ' not in chunk and '\t' not in chunk):
+            relative_paths = list(map(itemgetter(0), map(str.split, relative_paths)))
+        names = list(map(itemgetter(2),
+                         map(str.rpartition, relative_paths, ['/'] * len(relative_paths))))
+
+        # Split the rows of the chunk between the sensor, satellite and file type keys.
+        if len(set(sensors)) == 1 and len(set(sats)) == 1 and len(set(file_types)) == 1:
+            key_rows = {(sensors[0], sats[0], file_types[0]): None}
+        else:
+            key_rows = {}
+            for row, key in enumerate(zip(sensors, sats, file_types)):
+                key_rows.setdefault(key, []).append(row)
+
+        for key, kept in key_rows.items():
+            if key not in tables:
+                tables[key] = {'begin': array(INT64), 'end': array(INT64),
+                               'size': array(INT64), 'paths': []}
+                seen_names[key] = set()
+
+            # Drop the files of this key which have already been seen. In the usual chunk,
+            # holding a single key and only new files, this keeps every row.
+            key_names = seen_names[key]
+            rows = kept if kept is not None else range(len(names))
+            row_names = names if kept is None else list(map(names.__getitem__, rows))
+            if kept is None and len(set(names)) == len(names) and key_names.isdisjoint(names):
+                key_names.update(names)
+                select = lambda column: column
+            else:
+                # Map each name to its first row, by letting earlier rows overwrite later ones.
+                first_rows = dict(zip(reversed(row_names), reversed(rows)))
+                if key_names.isdisjoint(first_rows):
+                    kept_rows = sorted(first_rows.values())
+                else:
+                    kept_rows = sorted(map(first_rows.__getitem__,
+                                           set(first_rows).difference(key_names)))
+                key_names.update(first_rows)
+                select = lambda column: list(map(column.__getitem__, kept_rows))
+
+            begin = timestamps_to_usec(select(fields[2::9]), offsets)
+            end = timestamps_to_usec(select(fields[3::9]), offsets)
+
+            # Move any end times which are before their begin times forward a day
+            short = sum(map(lt, end, begin))
+            if short:
+                days_added += short
+                end = [end_time + DAY_USEC if end_time < begin_time else end_time
+                       for begin_time, end_time in zip(begin, end)]
+
+            table = tables[key]
+            table['begin'].extend(begin)
+            table['end'].extend(end)
+            table['size'].extend(map(int, map(float, select(fields[0::9]))))
+            table['paths'].extend(select(relative_paths))
+
+    if days_added:
+        LOG.warning("{} files have an end time before their begin time, added a day to them.".format(
+            days_added))
+
+    return tables
+
+
+class FileIndex(object):
+    '''
+    Time index over the metadata of a single sensor, satellite and file type.
+
+    The entries are held as int64 columns sorted by begin time, with the times as
+    microseconds since EPOCH, together with the running maximum of their end times.
+    Both sequences are non-decreasing, so the entries overlapping a time interval, or
+    starting at a given time, are found with binary searches.
+
+    To keep the index compact the relative paths are split in two. Their directories
+    are interned in dirs, and referred to by dir_index, while the file names are packed
+    end to end in the utf-8 names blob, with the name of row i at
+    names[name_offsets[i]:name_offsets[i + 1]].
+    '''
+
+    def __init__(self, begin, end, max_end, size, dir_index, name_offsets, names, dirs):
+
+        self.begin = begin
+        self.end = end
+        self.max_end = max_end
+        self.size = size
+        self.dir_index = dir_index
+        self.name_offsets = name_offsets
+        self.names = names
+        self.dirs = dirs
+        # Which rows are kept once duplicate granules are removed, computed on first use
+        self.keep = None
+
+    @classmethod
+    def from_columns(cls, begin, end, size, paths):
+        '''
+        Build the index from unsorted columns, as returned by parse_metadata().
+        '''
+        # Metadata lists are usually written in time order already, leaving nothing to sort.
+        if not all(map(le, begin[:-1], begin[1:])):
+            order = sorted(range(len(paths)), key=begin.__getitem__)
+            begin = array(INT64, map(begin.__getitem__, order))
+            end = array(INT64, map(end.__getitem__, order))
+            size = array(INT64, map(size.__getitem__, order))
+            paths = list(map(paths.__getitem__, order))
+
+        # The running maximum end time is just the end time while no file ends before the
+        # one preceding it.
+        max_end = array(INT64, end)
+        if not all(map(le, end[:-1], end[1:])):
+            for row in range(1, len(max_end)):
+                if max_end[row - 1] > max_end[row]:
+                    max_end[row] = max_end[row - 1]
+
+        # Split the paths into interned directories (with their trailing separator) and names.
+        dirs, seps, names = ((), (), ())
+        if paths:
+            dirs, seps, names = zip(*map(str.rpartition, paths, ['/'] * len(paths)))
+        dir_ids = {}
+        dir_index = array(INT64, [dir_ids.setdefault(dir_name + sep, len(dir_ids))
+                                  for dir_name, sep in zip(dirs, seps)])
+        dirs = [dir_name for dir_name, dir_id in sorted(dir_ids.items(), key=itemgetter(1))]
+
+        names = [name if isinstance(name, bytes) else name.encode('utf-8') for name in names]
+        name_offsets = array(INT64, [0])
+        for name in names:
+            name_offsets.append(name_offsets[-1] + len(name))
+
+        return cls(begin, end, max_end, size, dir_index, name_offsets, b''.join(names), dirs)
+
+    def extend(self, begin, end, size, paths):
+        '''
+        Add the rows of unsorted columns, as returned by parse_metadata(), to the index,
+        skipping any file already indexed with the same name and begin time. Returns the
+        number of rows added.
+        '''
+        rows = [row for row in range(len(paths))
+                if paths[row].rpartition('/')[2] not in
+                [self.name(other) for other in self.rows_at(begin[row])]]
+        if not rows:
+            return 0
+
+        new = FileIndex.from_columns(array(INT64, map(begin.__getitem__, rows)),
+                                     array(INT64, map(end.__getitem__, rows)),
+                                     array(INT64, map(size.__getitem__, rows)),
+                                     list(map(paths.__getitem__, rows)))
+
+        if len(self) and new.begin[0] < self.begin[-1]:
+            # The new rows interleave with the old ones, so rebuild the index from both.
+            rows = range(len(self))
+            combined = FileIndex.from_columns(
+                array(INT64, list(self.begin) + list(new.begin)),
+                array(INT64, list(self.end) + list(new.end)),
+                array(INT64, list(self.size) + list(new.size)),
+                list(map(self.path, rows)) + list(map(new.path, range(len(new)))))
+            self.__dict__.update(combined.__dict__)
+            return len(new)
+
+        self.keep = None
+
+        # Otherwise they follow on from the old rows, and are appended in place. A mapped
+        # snapshot is read-only, so its columns are copied first.
+        for column in ('begin', 'end', 'max_end', 'size', 'dir_index', 'name_offsets'):
+            if not isinstance(getattr(self, column), array):
+                setattr(self, column, array(INT64, getattr(self, column)))
+
+        dir_ids = dict((dir_name, dir_id) for dir_id, dir_name in enumerate(self.dirs))
+        for dir_name in new.dirs:
+            dir_ids.setdefault(dir_name, len(dir_ids))
+        self.dirs = [dir_name for dir_name, dir_id in sorted(dir_ids.items(), key=itemgetter(1))]
+
+        last_end = self.max_end[-1] if len(self) else new.max_end[0]
+        self.begin.extend(new.begin)
+        self.end.extend(new.end)
+        self.max_end.extend(max(last_end, max_end) for max_end in new.max_end)
+        self.size.extend(new.size)
+        self.dir_index.extend(dir_ids[new.dirs[dir_id]] for dir_id in new.dir_index)
+        names_end = self.name_offsets[-1]
+        self.name_offsets.extend(names_end + name_offset for name_offset in new.name_offsets[1:])
+        self.names = bytes(self.names) + new.names
+
+        return len(new)
+
+    def columns(self):
+        return {'begin': self.begin, 'end': self.end, 'max_end': self.max_end,
+                'size': self.size, 'dir_index': self.dir_index,
+                'name_offsets': self.name_offsets, 'names': self.names, 'dirs': self.dirs}
+
+    def __len__(self):
+        return len(self.begin)
+
+    def overlapping(self, interval):
+        '''
+        Return the rows which may overlap interval, in begin time order. Every row before
+        them ends before interval.left, and every row after them begins after interval.right.
+        '''
+        return range(*self.overlapping_bounds(interval))
+
+    def overlapping_bounds(self, interval):
+        '''
+        The first row of overlapping(interval), and the row after its last.
+        '''
+        first = bisect_left(self.max_end, to_usec(interval.left))
+        last = bisect_right(self.begin, to_usec(interval.right))
+        return first, max(first, last)
+
+    def starting_at(self, begin_time):
+        '''
+        Return the rows whose begin time is exactly begin_time.
+        '''
+        return self.rows_at(to_usec(begin_time))
+
+    def rows_at(self, begin_usec):
+        return range(bisect_left(self.begin, begin_usec), bisect_right(self.begin, begin_usec))
+
+    def rows_at_many(self, begin_usecs):
+        '''
+        Return the rows_at() of each of the sorted begin_usecs, searching forward from the
+        rows of the previous one rather than across the whole index.
+        '''
+        found = []
+        first = 0
+        for begin_usec in begin_usecs:
+            first = bisect_left(self.begin, begin_usec, first)
+            last = bisect_right(self.begin, begin_usec, first)
+            found.append(range(first, last))
+        return found
+
+    def duplicates(self):
+        '''
+        Resolve the duplicate granules, the rows sharing a begin time, keeping the one of
+        longest duration in each group, with ties going to the first name. Returns a
+        bytearray flagging the rows kept.
+        '''
+        if self.keep is None:
+            keep = bytearray(b'\x01') * len(self)
+
+            # Only the rows starting at the same time as the previous row need looking at.
+            repeats = list(compress(range(1, len(self)), map(eq, self.begin[:-1], self.begin[1:])))
+            if repeats:
+                groups = {}
+                for row in repeats:
+                    groups.setdefault(self.begin[row], set([row - 1])).add(row)
+
+                for rows in groups.values():
+                    best = min(rows, key=lambda row: (self.begin[row] - self.end[row], self.name(row)))
+                    for row in rows.difference([best]):
+                        keep[row] = 0
+
+                LOG.info("Discarded {} duplicate granules of {} files".format(
+                    len(repeats), len(self)))
+
+            self.keep = keep
+
+        return self.keep
+
+    def unique(self, rows):
+        '''
+        Return those of rows which are kept once duplicate granules are removed.
+        '''
+        keep = self.duplicates()
+        return [row for row in rows if keep[row]]
+
+    def name(self, row):
+        name = bytes(self.names[self.name_offsets[row]:self.name_offsets[row + 1]])
+        return name if isinstance(name, str) else name.decode('utf-8')
+
+    def path(self, row):
+        return self.dirs[self.dir_index[row]] + self.name(row)
+
+    def line(self, row):
+        '''
+        Return the metadata dict of a single row, as accepted by DeltaCatalog.file_info().
+        '''
+        name = self.name(row)
+        return {'data_interval': TimeInterval(from_usec(self.begin[row]), from_usec(self.end[row])),
+                'name': name,
+                'path': self.dirs[self.dir_index[row]] + name}
+
+
+class FileCache(object):
+    '''
+    The granules resolved by a catalog, keeping the max_size most recently added, so that
+    streaming the contexts of a long interval does not hold on to every granule of it. It may
+    be used by several threads at once.
+    '''
+
+    def __init__(self, max_size=FILE_CACHE_SIZE):
+        self.max_size = max_size
+        self.files = OrderedDict()
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.files)
+
+    def get(self, key):
+        with self.lock:
+            return self.files.get(key)
+
+    def __setitem__(self, key, value):
+        with self.lock:
+            self.files[key] = value
+            while len(self.files) > self.max_size:
+                self.files.popitem(last=False)
+
+
 DeltaFile = namedtuple('DeltaFile', ['name', 'data_interval', 'collection', 'path'])
 #delta_catalog = DeltaCatalog()
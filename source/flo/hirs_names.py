@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+hirs_names.py
+
+ * DESCRIPTION: Fast conversion between the Dyyjjj.SHHMM.EHHMM fields of NSS.HIRX file names and
+ times, giving the same results as util.hirs_to_time_interval() and util.time_interval_to_hirs().
+ Each fixed width field is converted by a table lookup rather than by strptime(), which also
+ checks it is in range. Names which the tables do not accept are passed to the util functions,
+ so that they are converted, or fail, in the same way.
+
+ The bulk functions convert lists of names to and from int64 arrays of the microseconds since
+ 1970-01-01, as used by the DeltaCatalog indices.
+
+Copyright (c) 2018 University of Wisconsin Regents.
+Licensed under GNU GPLv3.
+"""
+
+import logging
+from array import array
+from operator import add
+from datetime import datetime, timedelta
+
+from flo.time import TimeInterval
+
+from flo.sw.hirs2nc.snapshot import INT64
+from flo.sw.hirs2nc import util
+
+LOG = logging.getLogger(__name__)
+
+EPOCH = datetime(1970, 1, 1)
+DAY_SECONDS = 86400
+
+# The seconds of each field, as strptime reads it: %y years 69-99 are 19yy, the rest 20yy
+YEAR_SECONDS = dict(('{:02d}'.format(yy),
+                     (datetime(1900 + yy if yy >= 69 else 2000 + yy, 1, 1) - EPOCH).days
+                     * DAY_SECONDS)
+                    for yy in range(100))
+DAY_OF_YEAR_SECONDS = dict(('{:03d}'.format(day), (day - 1) * DAY_SECONDS)
+                           for day in range(1, 367))
+HOUR_SECONDS = dict(('{:02d}'.format(hour), hour * 3600) for hour in range(24))
+MINUTE_SECONDS = dict(('{:02d}'.format(minute), minute * 60) for minute in range(60))
+
+# The satellite of each NSS file name code
+SATELLITE_CODES = {'NA': 'noaa-06', 'NC': 'noaa-07', 'NE': 'noaa-08', 'NF': 'noaa-09',
+                   'NG': 'noaa-10', 'NH': 'noaa-11', 'ND': 'noaa-12', 'NJ': 'noaa-14',
+                   'NK': 'noaa-15', 'NL': 'noaa-16', 'NM': 'noaa-17', 'NN': 'noaa-18',
+                   'NP': 'noaa-19', 'M2': 'metop-a', 'M1': 'metop-b'}
+
+# HHMM for each minute of the day
+MINUTE_OF_DAY = ['{:02d}{:02d}'.format(*divmod(minute, 60)) for minute in range(1440)]
+
+# Dyyjjj for each day since EPOCH, filled in as they are needed
+day_fields = {}
+
+def total_seconds(delta):
+    # The whole seconds of delta, as an int
+    return delta.days * DAY_SECONDS + delta.seconds
+
+def parse_name(name):
+    '''
+    The begin and end times of the NSS.HIRX file name, as seconds since 1970-01-01. End times
+    before the begin time are moved to the next day. Raises ValueError as
+    util.hirs_to_time_interval() would for a malformed name.
+    '''
+    try:
+        if name[12] + name[18] + name[19] + name[25] != 'D.SE':
+            raise KeyError(name)
+        day = YEAR_SECONDS[name[13:15]] + DAY_OF_YEAR_SECONDS[name[15:18]]
+        begin = day + HOUR_SECONDS[name[20:22]] + MINUTE_SECONDS[name[22:24]]
+        end = day + HOUR_SECONDS[name[26:28]] + MINUTE_SECONDS[name[28:30]]
+    except (KeyError, IndexError, TypeError):
+        # Leave anything unusual to strptime
+        interval = util.hirs_to_time_interval(name)
+        return (total_seconds(interval.left - EPOCH), total_seconds(interval.right - EPOCH))
+
+    if end < begin:
+        end += DAY_SECONDS
+
+    return begin, end
+
+def hirs_to_time_interval(name):
+    '''
+    The TimeInterval of the NSS.HIRX file name, as util.hirs_to_time_interval().
+    '''
+    begin, end = parse_name(name)
+    return TimeInterval(EPOCH + timedelta(seconds=begin), EPOCH + timedelta(seconds=end))
+
+def format_seconds(begin, end):
+    '''
+    The Dyyjjj.SHHMM.EHHMM fields for begin and end, in seconds since 1970-01-01.
+    '''
+    day, begin_seconds = divmod(int(begin), DAY_SECONDS)
+    end_seconds = int(end) % DAY_SECONDS
+
+    if day not in day_fields:
+        date = EPOCH + timedelta(days=day)
+        day_fields[day] = 'D{:02d}{:03d}'.format(date.year % 100, date.timetuple().tm_yday)
+
+    return '{}.S{}.E{}'.format(day_fields[day], MINUTE_OF_DAY[begin_seconds // 60],
+                               MINUTE_OF_DAY[end_seconds // 60])
+
+def time_interval_to_hirs(interval):
+    '''
+    The Dyyjjj.SHHMM.EHHMM fields of interval, as util.time_interval_to_hirs().
+    '''
+    return format_seconds(total_seconds(interval.left - EPOCH),
+                          total_seconds(interval.right - EPOCH))
+
+def names_to_usec(names):
+    '''
+    The begin and end times of each of the NSS.HIRX file names, as int64 arrays of the
+    microseconds since 1970-01-01.
+    '''
+    begin, end = array(INT64), array(INT64)
+
+    try:
+        # Convert a field at a time, checking the separators of every name at once
+        if set(name[12] + name[18] + name[19] + name[25] for name in names) - set(['D.SE']):
+            raise KeyError('separators')
+        days = list(map(add, map(YEAR_SECONDS.__getitem__, [name[13:15] for name in names]),
+                        map(DAY_OF_YEAR_SECONDS.__getitem__, [name[15:18] for name in names])))
+        begin_seconds = list(map(add,
+                                 map(HOUR_SECONDS.__getitem__, [name[20:22] for name in names]),
+                                 map(MINUTE_SECONDS.__getitem__, [name[22:24] for name in names])))
+        end_seconds = list(map(add,
+                               map(HOUR_SECONDS.__getitem__, [name[26:28] for name in names]),
+                               map(MINUTE_SECONDS.__getitem__, [name[28:30] for name in names])))
+    except (KeyError, IndexError, TypeError):
+        # Some name is unusual, so convert them one at a time
+        for begin_time, end_time in map(parse_name, names):
+            begin.append(begin_time * 1000000)
+            end.append(end_time * 1000000)
+        return begin, end
+
+    for day, begin_time, end_time in zip(days, begin_seconds, end_seconds):
+        if end_time < begin_time:
+            end_time += DAY_SECONDS
+        begin.append((day + begin_time) * 1000000)
+        end.append((day + end_time) * 1000000)
+
+    return begin, end
+
+def usec_to_names(begin, end):
+    '''
+    The Dyyjjj.SHHMM.EHHMM fields for each of the begin and end times, in microseconds since
+    1970-01-01.
+    '''
+    return [format_seconds(begin_time // 1000000, end_time // 1000000)
+            for begin_time, end_time in zip(begin, end)]
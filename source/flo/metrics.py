@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+metrics.py
+
+ * DESCRIPTION: Timing of the phases of a task, emitted as one JSON record per task. A record is
+ opened with task_metrics(), and the phases inside it are timed with span(). Spans of the same
+ name are added together, along with the CPU time and block I/O of the child processes which
+ finished during them. The peak memory of the children is left out, as the system only gives it
+ over the life of the process. The record is written to the sink set by set_sink(), or named by
+ the HIRS2NC_METRICS environment variable, as a line of JSON; without a sink it is logged.
+
+ A record looks like:
+    {"task": "HIRS2NC.run_task", "status": "ok", "seconds": 412.3, "started": "...",
+     "context": {...}, "spans": {"convert": {"count": 1, "seconds": 390.1, "child_utime": ...}}}
+
+Copyright (c) 2018 University of Wisconsin Regents.
+Licensed under GNU GPLv3.
+"""
+
+import os
+import json
+import time
+import logging
+import resource
+import threading
+from datetime import datetime
+from contextlib import contextmanager
+from functools import wraps
+
+from flo.sw.hirs2nc.utils import execution_time
+
+LOG = logging.getLogger(__name__)
+
+# Where records are written: None to log them, a path to append them to, or a callable
+sink = os.environ.get('HIRS2NC_METRICS')
+sink_lock = threading.Lock()
+
+# The record open in each thread
+active = threading.local()
+
+def set_sink(new_sink):
+    '''
+    Send the records to new_sink: None to log them, the path of a file to append them to as
+    lines of JSON, or a callable taking each record as a dict.
+    '''
+    global sink
+    sink = new_sink
+
+def child_usage():
+    '''
+    The resource usage of the finished child processes, as a dict.
+    '''
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return {'child_utime': usage.ru_utime,
+            'child_stime': usage.ru_stime,
+            'child_inblock': usage.ru_inblock,
+            'child_oublock': usage.ru_oublock}
+
+class Span(object):
+    '''
+    The totals of the spans of one name in a record.
+    '''
+
+    def __init__(self, values, lock=None):
+        self.values = values
+        self.lock = lock or threading.Lock()
+
+    def add(self, **values):
+        '''
+        Add values to the totals of the span. Peak memory, ending in _maxrss_kb, is kept as the
+        largest value rather than summed.
+        '''
+        with self.lock:
+            for name, value in values.items():
+                if name.endswith('_maxrss_kb'):
+                    self.values[name] = max(self.values.get(name, 0), value)
+                else:
+                    self.values[name] = self.values.get(name, 0) + value
+
+class TaskMetrics(object):
+    '''
+    The record of a single task.
+    '''
+
+    def __init__(self, task, context=None):
+        self.lock = threading.Lock()
+        self.start = time.time()
+        self.record = {'task': task,
+                       'started': datetime.utcnow().isoformat(),
+                       'context': dict((key, str(value))
+                                       for key, value in (context or {}).items()),
+                       'spans': {}}
+        self.status = None
+
+    def span_totals(self, name):
+        with self.lock:
+            return Span(self.record['spans'].setdefault(name, {}), self.lock)
+
+    def emit(self, status):
+        status = self.status or status
+        self.record['status'] = status
+        self.record['seconds'] = time.time() - self.start
+
+        elapsed = execution_time(self.start, time.time())
+        LOG.debug("{} {} in {hours:d}h {minutes:d}m {seconds:.1f}s".format(
+            self.record['task'], status, **elapsed))
+
+        line = json.dumps(self.record, sort_keys=True)
+        if sink is None:
+            LOG.debug(line)
+        elif callable(sink):
+            sink(self.record)
+        else:
+            with sink_lock:
+                with open(sink, 'a') as file_obj:
+                    file_obj.write(line + '\n')
+
+def current():
+    '''
+    The record open in this thread, or None.
+    '''
+    return getattr(active, 'metrics', None)
+
+@contextmanager
+def task_metrics(task, context=None):
+    '''
+    Open the record of task for the current thread, emitting it when the block ends.
+    '''
+    metrics = TaskMetrics(task, context)
+    outer, active.metrics = current(), metrics
+    status = 'error'
+    try:
+        yield metrics
+        status = 'ok'
+    finally:
+        active.metrics = outer
+        try:
+            metrics.emit(status)
+        except Exception as err:
+            LOG.warning("Unable to write the metrics of {}: {}".format(task, err))
+
+def metered(context_arg):
+    '''
+    Decorate a Computation method to emit a record for each call, named after the class and
+    method, with the context passed as its positional argument context_arg. A method returning
+    a nonzero (rc, outputs) pair is recorded as failed.
+    '''
+    def decorator(func):
+        @wraps(func)
+        def wrapper(self, *args, **kwargs):
+            task = '{}.{}'.format(type(self).__name__, func.__name__)
+            with task_metrics(task, args[context_arg]) as metrics:
+                result = func(self, *args, **kwargs)
+                if isinstance(result, tuple) and result and result[0]:
+                    metrics.status = 'failed'
+                    metrics.record['rc'] = result[0]
+                return result
+        return wrapper
+    return decorator
+
+@contextmanager
+def span(name, metrics=None):
+    '''
+    Time the block as the span name of metrics, by default the record open in this thread.
+    Outside of a record the span is only logged.
+    '''
+    metrics = metrics or current()
+    start, usage = time.time(), child_usage()
+    totals = metrics.span_totals(name) if metrics is not None else Span({})
+
+    try:
+        yield totals
+    finally:
+        elapsed = time.time() - start
+        end_usage = child_usage()
+        totals.add(count=1, seconds=elapsed,
+                   **dict((key, value - usage[key]) for key, value in end_usage.items()))
+        if metrics is None:
+            LOG.debug("{} took {:.3f} seconds".format(name, elapsed))
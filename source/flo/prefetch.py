@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+prefetch.py
+
+ * DESCRIPTION: Copies the HIR1B inputs of the later granules of a HIRS2NCBatch task to
+ node-local scratch in background threads, so that reading the input of the next granule
+ overlaps the conversion of the current one. The staged files are kept within a byte budget,
+ evicting the least recently used when room is needed for another, and the task takes the staged
+ copy of an input when there is one.
+
+ The prefetcher is set up with set_prefetcher(), or from the HIRS2NC_SCRATCH environment variable,
+ naming the scratch directory, with the budget in bytes given by HIRS2NC_SCRATCH_BYTES.
+
+Copyright (c) 2018 University of Wisconsin Regents.
+Licensed under GNU GPLv3.
+"""
+
+import os
+import atexit
+import shutil
+import logging
+import threading
+from collections import OrderedDict
+from os.path import exists, join as pjoin
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+LOG = logging.getLogger(__name__)
+
+DEFAULT_BUDGET = 10 * 1024**3
+
+class Staged(object):
+    '''
+    A file being copied, or copied, to scratch.
+    '''
+
+    def __init__(self, path, size):
+        self.path = path
+        self.size = size
+        self.ready = threading.Event()
+        self.ok = False
+
+class Prefetcher(object):
+    '''
+    Stages files in scratch_dir with workers copying threads, keeping at most budget bytes of
+    them.
+    '''
+
+    def __init__(self, scratch_dir, budget=DEFAULT_BUDGET, workers=2):
+        self.scratch_dir = scratch_dir
+        self.budget = budget
+        self.used = 0
+        # The staged files by name, least recently used first
+        self.staged = OrderedDict()
+        self.lock = threading.Lock()
+        self.counts = {'hits': 0, 'misses': 0, 'copied': 0, 'evicted': 0}
+
+        if not exists(scratch_dir):
+            os.makedirs(scratch_dir)
+
+        self.work = queue.Queue()
+        for idx in range(workers):
+            thread = threading.Thread(target=self.worker)
+            thread.daemon = True
+            thread.start()
+
+    def make_room(self, size):
+        '''
+        Evict the least recently used of the finished files until size bytes more fit in the
+        budget, returning whether they do. Must be called holding the lock.
+        '''
+        for name in list(self.staged):
+            if self.used + size <= self.budget:
+                break
+            staged = self.staged[name]
+            if not staged.ready.is_set():
+                continue
+            del self.staged[name]
+            self.used -= staged.size
+            self.counts['evicted'] += 1
+            try:
+                os.remove(staged.path)
+            except OSError:
+                pass
+
+        return self.used + size <= self.budget
+
+    def schedule(self, files):
+        '''
+        Stage each of files, a sequence of (name, path, size) in the order they will be needed,
+        which are not already staged. Those already staged are marked as recently used. Stops
+        at the first which will not fit in the budget.
+        '''
+        for name, path, size in files:
+            with self.lock:
+                if name in self.staged:
+                    self.staged[name] = self.staged.pop(name)
+                    continue
+                if not self.make_room(size):
+                    LOG.debug("Prefetch budget of {} bytes is full".format(self.budget))
+                    return
+                staged = self.staged[name] = Staged(pjoin(self.scratch_dir, name), size)
+                self.used += size
+
+            self.work.put((name, path, staged))
+
+    def worker(self):
+        while True:
+            name, path, staged = self.work.get()
+            try:
+                partial = staged.path + '.part'
+                shutil.copyfile(path, partial)
+                os.rename(partial, staged.path)
+                with self.lock:
+                    # The size scheduled is only an estimate of the space used
+                    size = os.stat(staged.path).st_size
+                    if self.staged.get(name) is staged:
+                        self.used += size - staged.size
+                    staged.size = size
+                    self.counts['copied'] += 1
+                staged.ok = True
+            except Exception as err:
+                LOG.warning("Unable to prefetch {}: {}".format(path, err))
+                with self.lock:
+                    if self.staged.get(name) is staged:
+                        del self.staged[name]
+                        self.used -= staged.size
+            finally:
+                staged.ready.set()
+
+    def get(self, name, timeout=None):
+        '''
+        The path of the staged copy of the file name, waiting for it if it is being copied, or
+        None if it is not staged.
+        '''
+        with self.lock:
+            staged = self.staged.get(name)
+            if staged is not None:
+                self.staged[name] = self.staged.pop(name)
+
+        if staged is not None:
+            staged.ready.wait(timeout)
+
+        with self.lock:
+            if staged is not None and staged.ok:
+                self.counts['hits'] += 1
+                path = staged.path
+            else:
+                self.counts['misses'] += 1
+                path = None
+
+        LOG.debug("Prefetch: {hits} hits, {misses} misses, {copied} copied, {evicted} evicted"
+                  .format(**self.counts))
+
+        return path
+
+    def close(self):
+        '''
+        Remove the staged files, and the scratch directory if that leaves it empty.
+        '''
+        with self.lock:
+            staged, self.staged, self.used = self.staged, OrderedDict(), 0
+        for name in staged:
+            try:
+                os.remove(staged[name].path)
+            except OSError:
+                pass
+        try:
+            os.rmdir(self.scratch_dir)
+        except OSError:
+            pass
+
+prefetcher = None
+
+def set_prefetcher(scratch_dir, budget=DEFAULT_BUDGET, workers=2):
+    '''
+    Stage upcoming inputs in scratch_dir, using at most budget bytes. A scratch_dir of None
+    turns prefetching off.
+    '''
+    global prefetcher
+    if prefetcher is not None:
+        prefetcher.close()
+    prefetcher = Prefetcher(scratch_dir, budget, workers) if scratch_dir else None
+    return prefetcher
+
+@atexit.register
+def close_prefetcher():
+    if prefetcher is not None:
+        prefetcher.close()
+
+def get_prefetcher():
+    '''
+    The prefetcher of this process, set up from HIRS2NC_SCRATCH if there is none yet, or None.
+    Each process stages its files in a directory of its own under HIRS2NC_SCRATCH.
+    '''
+    if prefetcher is None and os.environ.get('HIRS2NC_SCRATCH'):
+        set_prefetcher(pjoin(os.environ['HIRS2NC_SCRATCH'], 'hirs2nc_{}'.format(os.getpid())),
+                       int(os.environ.get('HIRS2NC_SCRATCH_BYTES', DEFAULT_BUDGET)))
+    return prefetcher
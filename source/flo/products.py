@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+products.py
+
+ * DESCRIPTION: An index of the HIRS2NC products which already exist, so that find_contexts() can
+ leave out the granules which have already been converted. Each product is keyed by the name of
+ its HIR1B input, the hirs2nc delivery_id and the satellite_version it was converted with.
+
+ The index is read from a manifest, or built by a scan of the product store. A manifest has a
+ line per product of whitespace separated fields:
+    input_name hirs2nc_delivery_id version [path]
+ with blank lines and lines starting with '#' ignored.
+
+ As the product files do not name the delivery which made them, a scan must be of a directory
+ holding only the products of a single delivery. Its path may contain '{hirs2nc_delivery_id}',
+ which is filled in with the delivery being scanned for.
+
+Copyright (c) 2018 University of Wisconsin Regents.
+Licensed under GNU GPLv3.
+"""
+
+import logging
+
+from flo.sw.hirs2nc.scan import DirectoryScan
+from flo.sw.hirs2nc.hirs_names import SATELLITE_CODES, parse_name
+from timeutil import datetime
+
+LOG = logging.getLogger(__name__)
+
+class ProductIndex(object):
+    '''
+    The set of (input_name, hirs2nc_delivery_id, version) of the products which exist, and the
+    number of contexts which find_contexts() has skipped because of them.
+    '''
+
+    # The endings of product file names, after the name of their input
+    suffixes = ('.nc.gz', '.nc')
+
+    def __init__(self):
+        self.products = set()
+        self.skipped = 0
+
+    def __len__(self):
+        return len(self.products)
+
+    def __contains__(self, key):
+        return key in self.products
+
+    def add(self, input_name, hirs2nc_delivery_id, version):
+        self.products.add((input_name, hirs2nc_delivery_id, int(version)))
+
+    def read_manifest(self, path):
+        '''
+        Add the products listed in the manifest path, returning how many there were.
+        '''
+        count = 0
+        with open(path) as file_obj:
+            for line in file_obj:
+                fields = line.split()
+                if not fields or fields[0].startswith('#'):
+                    continue
+                try:
+                    self.add(*fields[:3])
+                except (TypeError, ValueError):
+                    LOG.warning("Skipping malformed manifest line: {}".format(line.rstrip()))
+                    continue
+                count += 1
+
+        LOG.info("Read {} products from {}".format(count, path))
+
+        return count
+
+    def write_manifest(self, path):
+        '''
+        Write the products of the index to the manifest path.
+        '''
+        with open(path, 'w') as file_obj:
+            for product in sorted(self.products):
+                file_obj.write('{} {} {}\n'.format(*product))
+
+    def input_name(self, name):
+        '''
+        The name of the input of the product file name, or None if it is not a product.
+        '''
+        if not name.startswith('NSS.HIRX.') or name[9:11] not in SATELLITE_CODES:
+            return None
+        for suffix in self.suffixes:
+            if name.endswith(suffix):
+                return name[:-len(suffix)]
+        return None
+
+    def scan(self, root, hirs2nc_delivery_id, satellite_version, workers=8):
+        '''
+        Add the non-empty products found under the directory root, which holds the products
+        of hirs2nc_delivery_id alone, with the version given by satellite_version(satellite,
+        granule). Any '{hirs2nc_delivery_id}' in root is replaced by hirs2nc_delivery_id.
+        Returns how many there were.
+        '''
+        root = root.replace('{hirs2nc_delivery_id}', hirs2nc_delivery_id)
+        directory_scan = DirectoryScan(root, workers=workers)
+        directory_scan.scan()
+
+        count = 0
+        for path in sorted(directory_scan.directories):
+            for name, size in directory_scan.directories[path][2]:
+                input_name = self.input_name(name)
+                if input_name is None or not size:
+                    continue
+                try:
+                    # In local time, as are the granules of the catalog
+                    granule = datetime.fromtimestamp(parse_name(input_name)[0])
+                except ValueError:
+                    LOG.warning("Skipping {}, which has no times in its name".format(name))
+                    continue
+                version = satellite_version(SATELLITE_CODES[name[9:11]], granule)
+                self.add(input_name, hirs2nc_delivery_id, version)
+                count += 1
+
+        LOG.info("Found {} products under {}".format(count, root))
+
+        return count
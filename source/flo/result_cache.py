@@ -0,0 +1,225 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+result_cache.py
+
+ * DESCRIPTION: A content addressed cache of the compressed HIRS2NC outputs, so that converting
+ an input again with the same delivery and HIRS version copies the earlier output rather than
+ running hirs2nc. An entry is keyed by the SHA-256 of the input file's contents, its name, the
+ hirs2nc_delivery_id and the satellite_version, and holds the compressed output and its
+ extra_attrs. The name is part of the key as the output is named after the input, so an input
+ of the same contents under another name is converted again. The entries are kept within a byte cap, evicting the least recently used.
+
+ The cache is set up with set_result_cache(), or from the HIRS2NC_RESULT_CACHE environment
+ variable, naming the cache directory, with the cap in bytes given by HIRS2NC_RESULT_CACHE_BYTES.
+ The directory may be shared by the processes of a node, or of a cluster.
+
+ Each entry is a directory <cache_dir>/<key[:2]>/<key> holding the output and an entry.json of
+ its name and extra_attrs, whose modification time is when the entry was last used.
+
+Copyright (c) 2018 University of Wisconsin Regents.
+Licensed under GNU GPLv3.
+"""
+
+import os
+import json
+import shutil
+import hashlib
+import logging
+import tempfile
+import threading
+from datetime import datetime
+from os.path import basename, exists, getsize, isdir, join as pjoin
+
+from flo.sw.hirs2nc.delta import from_usec, to_usec
+
+LOG = logging.getLogger(__name__)
+
+DEFAULT_MAX_BYTES = 50 * 1024**3
+CHUNK_SIZE = 1024 * 1024
+
+def file_digest(path):
+    '''
+    The SHA-256 hex digest of the contents of the file path.
+    '''
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file_obj:
+        for chunk in iter(lambda: file_obj.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def encode_attrs(extra_attrs):
+    # datetimes are kept as {"usec": microseconds since 1970-01-01}
+    return dict((name, {'usec': to_usec(value)} if isinstance(value, datetime) else value)
+                for name, value in extra_attrs.items())
+
+def decode_attrs(extra_attrs):
+    return dict((str(name), from_usec(value['usec'])
+                 if isinstance(value, dict) and list(value) == ['usec'] else value)
+                for name, value in extra_attrs.items())
+
+class ResultCache(object):
+    '''
+    The cached outputs in cache_dir, kept to at most max_bytes.
+    '''
+
+    def __init__(self, cache_dir, max_bytes=DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.counts = {'hits': 0, 'misses': 0, 'stored': 0, 'evicted': 0}
+        # The digest of each input file, keyed by its (path, size, mtime)
+        self.digests = {}
+        # The (size, last used) of each entry, as last scanned, or None before the first scan
+        self.entries = None
+
+        if not exists(cache_dir):
+            os.makedirs(cache_dir)
+
+    def key(self, input_file, hirs2nc_delivery_id, version):
+        '''
+        The key of the output of converting input_file with hirs2nc_delivery_id and version.
+        '''
+        status = os.stat(input_file)
+        file_key = (input_file, status.st_size, status.st_mtime)
+        if file_key not in self.digests:
+            self.digests[file_key] = file_digest(input_file)
+
+        return hashlib.sha256('{}\0{}\0{}\0{}'.format(
+            self.digests[file_key], basename(input_file), hirs2nc_delivery_id,
+            version).encode('utf-8')).hexdigest()
+
+    def entry_dir(self, key):
+        return pjoin(self.cache_dir, key[:2], key)
+
+    def get(self, key, work_dir):
+        '''
+        Copy the output of the entry key to work_dir, returning its name and extra_attrs, or
+        None if there is no such entry.
+        '''
+        entry_dir = self.entry_dir(key)
+        try:
+            with open(pjoin(entry_dir, 'entry.json')) as file_obj:
+                entry = json.load(file_obj)
+            output = pjoin(work_dir, entry['name'])
+            if exists(output):
+                os.remove(output)
+            # A copy rather than a link, so that changing the product cannot change the entry
+            shutil.copyfile(pjoin(entry_dir, entry['name']), output)
+            os.utime(pjoin(entry_dir, 'entry.json'), None)
+        except (IOError, OSError, ValueError, KeyError):
+            self.count('misses')
+            return None
+
+        self.count('hits')
+        return str(entry['name']), decode_attrs(entry['extra_attrs'])
+
+    def put(self, key, output, extra_attrs):
+        '''
+        Store the output file and its extra_attrs as the entry key, then evict entries until
+        the cache is within its cap.
+        '''
+        entry_dir = self.entry_dir(key)
+        if exists(entry_dir):
+            return
+
+        parent = pjoin(self.cache_dir, key[:2])
+        if not exists(parent):
+            try:
+                os.makedirs(parent)
+            except OSError:
+                pass
+
+        # Fill in the entry beside its final place, so that it appears whole
+        partial = tempfile.mkdtemp(prefix='.{}.'.format(key), dir=parent)
+        try:
+            name = basename(output)
+            shutil.copyfile(output, pjoin(partial, name))
+            with open(pjoin(partial, 'entry.json'), 'w') as file_obj:
+                json.dump({'name': name, 'extra_attrs': encode_attrs(extra_attrs)}, file_obj)
+            os.rename(partial, entry_dir)
+        except OSError:
+            # Another process stored the same entry first
+            shutil.rmtree(partial, ignore_errors=True)
+            return
+
+        size = getsize(pjoin(entry_dir, name))
+        with self.lock:
+            self.counts['stored'] += 1
+            if self.entries is not None:
+                self.entries[key] = (size, os.stat(pjoin(entry_dir, 'entry.json')).st_mtime)
+        self.evict()
+
+    def scan(self):
+        '''
+        Return the (size, last used) of each entry in the cache directory.
+        '''
+        entries = {}
+        for prefix in os.listdir(self.cache_dir):
+            if not isdir(pjoin(self.cache_dir, prefix)):
+                continue
+            for key in os.listdir(pjoin(self.cache_dir, prefix)):
+                if key.startswith('.'):
+                    continue
+                try:
+                    entry_dir = pjoin(self.cache_dir, prefix, key)
+                    used = os.stat(pjoin(entry_dir, 'entry.json')).st_mtime
+                    entries[key] = (sum(getsize(pjoin(entry_dir, name))
+                                        for name in os.listdir(entry_dir)), used)
+                except OSError:
+                    continue
+        return entries
+
+    def evict(self):
+        '''
+        Remove the least recently used entries until those left fit in max_bytes. The cache
+        directory is only scanned again once the entries known to this process exceed it.
+        '''
+        with self.lock:
+            if self.entries is None or sum(size for size, used in self.entries.values()) > \
+                    self.max_bytes:
+                self.entries = self.scan()
+
+            total = sum(size for size, used in self.entries.values())
+            for key in sorted(self.entries, key=lambda key: self.entries[key][1]):
+                if total <= self.max_bytes:
+                    break
+                shutil.rmtree(self.entry_dir(key), ignore_errors=True)
+                total -= self.entries.pop(key)[0]
+                self.counts['evicted'] += 1
+
+    def count(self, name):
+        with self.lock:
+            self.counts[name] += 1
+            lookups = self.counts['hits'] + self.counts['misses']
+            LOG.info("Result cache: {hits} hits, {misses} misses ({rate:.1f}% hit rate), "
+                     "{stored} stored, {evicted} evicted".format(
+                         rate=100. * self.counts['hits'] / lookups, **self.counts))
+
+    def hit_rate(self):
+        '''
+        The fraction of the lookups by this process which were hits.
+        '''
+        lookups = self.counts['hits'] + self.counts['misses']
+        return float(self.counts['hits']) / lookups if lookups else 0.
+
+result_cache = None
+
+def set_result_cache(cache_dir, max_bytes=DEFAULT_MAX_BYTES):
+    '''
+    Cache outputs in cache_dir, using at most max_bytes. A cache_dir of None turns the cache
+    off.
+    '''
+    global result_cache
+    result_cache = ResultCache(cache_dir, max_bytes) if cache_dir else None
+    return result_cache
+
+def get_result_cache():
+    '''
+    The result cache of this process, set up from HIRS2NC_RESULT_CACHE if there is none yet,
+    or None.
+    '''
+    if result_cache is None and os.environ.get('HIRS2NC_RESULT_CACHE'):
+        set_result_cache(os.environ['HIRS2NC_RESULT_CACHE'],
+                         int(os.environ.get('HIRS2NC_RESULT_CACHE_BYTES', DEFAULT_MAX_BYTES)))
+    return result_cache
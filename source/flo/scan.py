@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+scan.py
+
+ * DESCRIPTION: Builds the columns of the DeltaCatalog indices by walking an archive directory tree,
+ rather than from a metadata list, taking the time interval and satellite of each file from its
+ NSS.HIRX name. The directories of each level of the tree are listed in parallel, and the
+ modification time of each is remembered, so that a later scan only lists the directories
+ which have changed.
+
+Copyright (c) 2018 University of Wisconsin Regents.
+Licensed under GNU GPLv3.
+"""
+
+import os
+import stat
+import logging
+from array import array
+from multiprocessing.pool import ThreadPool
+from os.path import relpath, join as pjoin
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+from flo.sw.hirs2nc.snapshot import INT64
+from flo.sw.hirs2nc.hirs_names import SATELLITE_CODES, names_to_usec, parse_name
+
+LOG = logging.getLogger(__name__)
+
+def list_directory(path):
+    '''
+    Return the modification time of the directory path, the names of its subdirectories and
+    the (name, size) of each of its files.
+    '''
+    mtime = os.stat(path).st_mtime
+    subdirs, files = [], []
+
+    if scandir is not None:
+        for entry in scandir(path):
+            if entry.is_dir():
+                subdirs.append(entry.name)
+            elif entry.is_file():
+                files.append((entry.name, entry.stat().st_size))
+    else:
+        for name in os.listdir(path):
+            status = os.stat(pjoin(path, name))
+            if stat.S_ISDIR(status.st_mode):
+                subdirs.append(name)
+            elif stat.S_ISREG(status.st_mode):
+                files.append((name, status.st_size))
+
+    return mtime, sorted(subdirs), sorted(files)
+
+class DirectoryScan(object):
+    '''
+    The listing of the directory tree under root, kept up to date by scan(), which lists
+    workers directories at a time.
+    '''
+
+    def __init__(self, root, workers=8):
+        self.root = root
+        self.workers = workers
+        # The (mtime, subdirectories, files) of each directory
+        self.directories = {}
+
+    def visit(self, path):
+        '''
+        Return the listing of path and whether it was listed again, reusing the last listing
+        if the directory has not been modified since.
+        '''
+        try:
+            known = self.directories.get(path)
+            if known is not None and os.stat(path).st_mtime == known[0]:
+                return known, False
+            return list_directory(path), True
+        except OSError as err:
+            LOG.warning("Unable to scan {}: {}".format(path, err))
+            return None, True
+
+    def scan(self):
+        '''
+        Bring the listing up to date, returning the number of directories which were listed
+        again, or have gone.
+        '''
+        changed = 0
+        found = set()
+        level = [self.root]
+
+        pool = ThreadPool(self.workers)
+        try:
+            while level:
+                next_level = []
+                for path, (listing, relisted) in zip(level, pool.map(self.visit, level)):
+                    changed += relisted
+                    if listing is None:
+                        continue
+                    found.add(path)
+                    self.directories[path] = listing
+                    next_level.extend(pjoin(path, subdir) for subdir in listing[1])
+                level = next_level
+        finally:
+            pool.close()
+            pool.join()
+
+        for path in set(self.directories) - found:
+            del self.directories[path]
+            changed += 1
+
+        LOG.debug("Scanned {} directories under {}, {} changed".format(
+            len(self.directories), self.root, changed))
+
+        return changed
+
+    def tables(self, file_type, sensor='hirs'):
+        '''
+        Return a dict of the columns accepted by FileIndex.from_columns() for each
+        (sensor, satellite, file_type) of the NSS.HIRX files found. As with the metadata lists,
+        only the first file of each name is kept, and the paths are relative to the root. The
+        times are UTC, as given by the names.
+        '''
+        names, paths, sizes = [], [], []
+        seen = set()
+
+        for path in sorted(self.directories):
+            for name, size in self.directories[path][2]:
+                if (name.startswith('NSS.HIRX.') and name[9:11] in SATELLITE_CODES
+                        and name not in seen):
+                    seen.add(name)
+                    names.append(name)
+                    paths.append(relpath(pjoin(path, name), self.root))
+                    sizes.append(size)
+
+        try:
+            begin, end = names_to_usec(names)
+            rows = range(len(names))
+        except ValueError:
+            begin, end, rows = array(INT64), array(INT64), []
+            for row, name in enumerate(names):
+                try:
+                    begin_time, end_time = parse_name(name)
+                except ValueError:
+                    LOG.warning("Skipping {}, which has no times in its name".format(paths[row]))
+                    continue
+                begin.append(begin_time * 1000000)
+                end.append(end_time * 1000000)
+                rows.append(row)
+
+        tables = {}
+        for idx, row in enumerate(rows):
+            key = (sensor, SATELLITE_CODES[names[row][9:11]], file_type)
+            if key not in tables:
+                tables[key] = {'begin': array(INT64), 'end': array(INT64),
+                               'size': array(INT64), 'paths': []}
+            table = tables[key]
+            table['begin'].append(begin[idx])
+            table['end'].append(end[idx])
+            table['size'].append(sizes[row])
+            table['paths'].append(paths[row])
+
+        return tables
@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+snapshot.py
+
+ * DESCRIPTION: Binary snapshots of the parsed DeltaCatalog metadata, so that processes can map
+ the columnar time index of a metadata list rather than re-parsing the list itself.
+
+ A snapshot holds a fixed header, a JSON table of contents and, for each (sensor, satellite,
+ file_type), the 8-byte aligned int64 columns of its FileIndex followed by the packed file names.
+ The interned directories are kept in the table of contents. The header records the size and
+ modification time of the source list, and the local timezone the times were converted in, so a
+ snapshot is only used while it matches its source.
+
+Copyright (c) 2018 University of Wisconsin Regents.
+Licensed under GNU GPLv3.
+"""
+
+import os
+import sys
+import json
+import mmap
+import struct
+import hashlib
+import logging
+import time
+from array import array
+from os.path import basename, abspath, exists, join as pjoin
+
+# every module should have a LOG object
+LOG = logging.getLogger(__name__)
+
+MAGIC = b'HIRSCAT2'
+HEADER = struct.Struct('<8sqqqqq')
+# The int64 columns of each table, all of which have a value per file bar name_offsets,
+# which has one more.
+COLUMNS = ['begin', 'end', 'max_end', 'size', 'dir_index', 'name_offsets']
+
+try:
+    array('q')
+    INT64 = 'q'
+except ValueError:
+    # Python 2 has no 'q' typecode, but 'l' is 64 bits on the LP64 platforms we run on.
+    INT64 = 'l'
+
+
+def source_key(source):
+    '''
+    The (size, mtime, timezone, altzone) tuple which a snapshot of source must match.
+    '''
+    stat = os.stat(source)
+    return (stat.st_size, int(round(stat.st_mtime * 1.e6)), time.timezone, time.altzone)
+
+
+def snapshot_path(snapshot_dir, source):
+    '''
+    The snapshot file in snapshot_dir for the metadata list source.
+    '''
+    digest = hashlib.md5(abspath(source).encode('utf-8')).hexdigest()[:12]
+    return pjoin(snapshot_dir, '{}.{}.snap'.format(basename(source), digest))
+
+
+def _padding(nbytes):
+    return (-nbytes) % 8
+
+
+def write_snapshot(path, source_key, tables):
+    '''
+    Write tables, a dict of {(sensor, sat, file_type): columns} where columns is the dict
+    given by FileIndex.columns(), to path. The file is written alongside and renamed into
+    place, so readers never see a partial snapshot.
+    '''
+    keys = sorted(tables.keys())
+    toc = json.dumps([{'key': list(key),
+                       'count': len(tables[key]['begin']),
+                       'blob': len(tables[key]['names']),
+                       'dirs': list(tables[key]['dirs'])}
+                      for key in keys]).encode('utf-8')
+
+    tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+    with open(tmp_path, 'wb') as snapshot:
+        snapshot.write(HEADER.pack(MAGIC, *(source_key + (len(toc),))))
+        snapshot.write(toc + b'\0' * _padding(len(toc)))
+        for key in keys:
+            for column in COLUMNS:
+                column = tables[key][column]
+                if not isinstance(column, array) or column.typecode != INT64:
+                    column = array(INT64, column)
+                column.tofile(snapshot)
+            blob = bytes(tables[key]['names'])
+            snapshot.write(blob + b'\0' * _padding(len(blob)))
+
+    os.rename(tmp_path, path)
+    LOG.debug("Wrote catalog snapshot {}".format(path))
+
+
+def _int64_column(buf, offset, count):
+    '''
+    An int64 view of count items of buf at offset. On Python 3 this is a zero-copy view of
+    the mapped snapshot, elsewhere it is copied into an array.
+    '''
+    nbytes = count * 8
+    try:
+        return memoryview(buf)[offset:offset + nbytes].cast(INT64)
+    except (AttributeError, TypeError):
+        column = array(INT64)
+        column.fromstring(buf[offset:offset + nbytes])
+        return column
+
+
+def _bytes(buf, offset, count):
+    '''
+    A view of count bytes of buf at offset, zero-copy where memoryviews allow it.
+    '''
+    if sys.version_info[0] < 3:
+        return buf[offset:offset + count]
+    return memoryview(buf)[offset:offset + count]
+
+
+def read_snapshot(path, source_key):
+    '''
+    Map the snapshot at path and return its tables, in the form accepted by write_snapshot,
+    or None if there is no snapshot or it does not match source_key.
+    '''
+    if not exists(path):
+        return None
+
+    try:
+        with open(path, 'rb') as snapshot:
+            buf = mmap.mmap(snapshot.fileno(), 0, access=mmap.ACCESS_READ)
+
+        header = HEADER.unpack(buf[:HEADER.size])
+        if header[0] != MAGIC or tuple(header[1:5]) != tuple(source_key):
+            LOG.debug("Catalog snapshot {} is stale".format(path))
+            return None
+
+        offset = HEADER.size
+        toc_size = header[5]
+        toc = json.loads(buf[offset:offset + toc_size].decode('utf-8'))
+        offset += toc_size + _padding(toc_size)
+
+        tables = {}
+        for entry in toc:
+            count = entry['count']
+            columns = {}
+            for column in COLUMNS:
+                length = count + 1 if column == 'name_offsets' else count
+                columns[column] = _int64_column(buf, offset, length)
+                offset += length * 8
+            columns['names'] = _bytes(buf, offset, entry['blob'])
+            offset += entry['blob'] + _padding(entry['blob'])
+            columns['dirs'] = [str(dir_name) for dir_name in entry['dirs']]
+            tables[tuple(str(part) for part in entry['key'])] = columns
+
+    except Exception:
+        LOG.warning("Unable to read catalog snapshot {}, ignoring it.".format(path))
+        return None
+
+    LOG.debug("Mapped catalog snapshot {}".format(path))
+    return tables
@@ -0,0 +1,276 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+submit.py
+
+ * DESCRIPTION: Submission of HIRS2NC contexts for many time intervals and satellites. The
+ contexts of each satellite are found with one catalog query per contiguous run of intervals, and
+ are submitted by a bounded pool of threads which adapts how many submissions it has in flight to
+ how quickly (and whether) they complete, rather than sleeping between intervals.
+
+Copyright (c) 2018 University of Wisconsin Regents.
+Licensed under GNU GPLv3.
+"""
+
+import time
+import logging
+import threading
+import traceback
+from bisect import bisect_left, bisect_right
+from operator import itemgetter
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from flo.ui import safe_submit_order
+from timeutil import TimeInterval, timedelta
+
+LOG = logging.getLogger(__name__)
+
+def interval_runs(intervals, gap=timedelta(seconds=1.)):
+    '''
+    Group intervals into runs, where each interval starts no more than gap after the end of
+    the previous one. Returns a list of lists of intervals, sorted by their start times.
+    '''
+    runs = []
+
+    for interval in sorted(intervals, key=lambda interval: interval.left):
+        if runs and interval.left - runs[-1][-1].right <= gap:
+            runs[-1].append(interval)
+        else:
+            runs.append([interval])
+
+    return runs
+
+def context_options(produced=None, overlaps=None):
+    # The find_contexts() options which are in use, so that computations without them work
+    options = {}
+    if produced is not None:
+        options['produced'] = produced
+    if overlaps is not None:
+        options['overlaps'] = overlaps
+    return options
+
+def plan_contexts(comp, satellite, intervals, hirs2nc_delivery_id, produced=None, overlaps=None):
+    '''
+    Find the contexts of satellite for each of the intervals, querying the catalog once for
+    each run of adjacent intervals. Returns a list of (interval, contexts) pairs, in the order of
+    the intervals, with the contexts of each sorted by granule. If produced is given, a
+    ProductIndex, and overlaps, an OverlapResolver, they are passed on to find_contexts() to
+    leave out what has been produced, and granules covered by others.
+    '''
+    contexts_by_interval = {}
+    options = context_options(produced, overlaps)
+
+    for run in interval_runs(intervals):
+        hull = TimeInterval(run[0].left, max(interval.right for interval in run))
+        contexts = sorted(comp.find_contexts(hull, satellite, hirs2nc_delivery_id, **options),
+                          key=itemgetter('granule'))
+        granules = [context['granule'] for context in contexts]
+
+        # The contexts of an interval are those with a granule inside it
+        for interval in run:
+            first = bisect_left(granules, interval.left)
+            last = bisect_right(granules, interval.right)
+            contexts_by_interval[id(interval)] = contexts[first:last]
+
+    return [(interval, contexts_by_interval[id(interval)]) for interval in intervals]
+
+def stream_contexts(comp, satellite, intervals, hirs2nc_delivery_id, produced=None,
+                    chunk_size=1000, overlaps=None):
+    '''
+    Yield (interval, contexts) pairs for each of the intervals, as plan_contexts() returns,
+    but with the contexts of an interval found lazily by comp.iter_contexts(), in lists made
+    from chunk_size files at a time.
+    '''
+    options = context_options(produced, overlaps)
+
+    for interval in intervals:
+        for contexts in comp.iter_contexts(interval, satellite, hirs2nc_delivery_id,
+                                           chunk_size=chunk_size, **options):
+            yield interval, contexts
+
+class SubmissionEngine(object):
+    '''
+    Submits the contexts of many intervals and satellites through a pool of max_workers threads.
+
+    The number of submissions allowed in flight starts at one. It grows by one after each
+    submission which completes within target_latency seconds, and halves after one which is
+    slower or fails. A failure also holds back new submissions for backoff seconds, doubling
+    with each consecutive failure up to max_backoff seconds. The job numbers of every submission are written to the single
+    log stream log_name as they complete.
+    '''
+
+    def __init__(self, log_name, max_workers=4, target_latency=60., backoff=5.,
+                 submit=safe_submit_order, max_backoff=300.):
+
+        self.log_name = log_name
+        self.max_workers = max(1, max_workers)
+        self.target_latency = target_latency
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.submit = submit
+
+        self.limit = 1
+        self.active = 0
+        self.failures = 0
+        self.resume_at = 0.
+        self.condition = threading.Condition()
+        self.log_lock = threading.Lock()
+        self.summary = {}
+
+    def acquire(self):
+        '''
+        Wait until another submission may be started.
+        '''
+        with self.condition:
+            while True:
+                delay = self.resume_at - time.time()
+                if self.active < self.limit and delay <= 0.:
+                    break
+                self.condition.wait(delay if delay > 0. else None)
+            self.active += 1
+
+    def release(self, latency, ok):
+        '''
+        Finish a submission which took latency seconds, and adapt the concurrency limit.
+        '''
+        with self.condition:
+            self.active -= 1
+
+            if ok:
+                self.failures = 0
+            if ok and latency <= self.target_latency:
+                self.limit = min(self.max_workers, self.limit + 1)
+            else:
+                self.limit = max(1, self.limit // 2)
+
+            if not ok:
+                self.failures += 1
+                # Capping the exponent as well keeps the delay finite after many failures
+                self.resume_at = time.time() + min(
+                    self.max_backoff, self.backoff * 2**min(self.failures - 1, 30))
+                LOG.warning("Holding back submissions for {:.0f} seconds".format(
+                    self.resume_at - time.time()))
+
+            self.condition.notify_all()
+
+    def write(self, line):
+        with self.log_lock:
+            self.file_obj.write(line + '\n')
+            self.file_obj.flush()
+
+    def submit_interval(self, comp, satellite, interval, contexts):
+        '''
+        Submit the contexts of a single interval, and record the job numbers in the log.
+        '''
+        first, last = contexts[0], contexts[-1]
+
+        self.acquire()
+        start = time.time()
+        try:
+            job_nums = self.submit(comp, [comp.dataset(name) for name in comp.outputs],
+                                   contexts)
+        except Exception:
+            LOG.warning(traceback.format_exc())
+            self.release(time.time() - start, ok=False)
+            self.write("contexts: [{}, {}]; --> submission failed".format(first, last))
+            self.count('failed', len(contexts))
+            return
+        self.release(time.time() - start, ok=True)
+
+        if job_nums:
+            LOG.info("{} {} -> {}: job numbers: [{}..{}]".format(
+                satellite, interval.left, interval.right, job_nums[0], job_nums[-1]))
+            self.write("contexts: [{}, {}]; job numbers: [{}..{}]".format(
+                first, last, job_nums[0], job_nums[-1]))
+        else:
+            LOG.info("{} {} -> {}: no jobs".format(satellite, interval.left, interval.right))
+            self.write("contexts: [{}, {}]; --> no jobs".format(first, last))
+
+        self.count('submitted', len(contexts))
+        self.count('jobs', len(job_nums))
+
+    def count(self, name, value):
+        with self.log_lock:
+            self.summary[name] = self.summary.get(name, 0) + value
+
+    def worker(self, work):
+        while True:
+            item = work.get()
+            if item is None:
+                return
+            try:
+                self.submit_interval(*item)
+            except Exception:
+                LOG.warning(traceback.format_exc())
+
+    def run(self, setup, satellites, intervals, hirs2nc_delivery_id, produced=None,
+            chunk_size=None, overlaps=None):
+        '''
+        Submit the contexts of each satellite in satellites over each of the intervals. The
+        computation for a satellite is returned by setup(satellite). If produced is given, a
+        ProductIndex, the granules which already have a product are skipped. If overlaps is
+        given, an OverlapResolver, the granules mostly covered by others are dropped. With
+        chunk_size, the contexts are streamed from the catalog and submitted in lists made from
+        chunk_size files, so that however long the intervals the first jobs go out at once.
+        Returns a dict of the numbers of contexts found, skipped, dropped as overlapping,
+        submitted and failed, and of the jobs created.
+        '''
+        start = time.time()
+        self.summary = {'contexts': 0, 'skipped': 0, 'overlapping': 0, 'submitted': 0,
+                        'failed': 0, 'jobs': 0}
+        skipped = produced.skipped if produced is not None else 0
+        dropped = overlaps.counts['dropped'] if overlaps is not None else 0
+
+        LOG.info("Opening log file {}".format(self.log_name))
+        self.file_obj = open(self.log_name, 'a')
+
+        # Contexts are found while earlier intervals are being submitted, with at most a couple
+        # of intervals per worker waiting to be submitted.
+        work = queue.Queue(maxsize=2 * self.max_workers)
+        workers = [threading.Thread(target=self.worker, args=(work,))
+                   for idx in range(self.max_workers)]
+        for thread in workers:
+            thread.daemon = True
+            thread.start()
+
+        try:
+            for satellite in satellites:
+                comp = setup(satellite)
+
+                if chunk_size:
+                    planned = stream_contexts(comp, satellite, intervals, hirs2nc_delivery_id,
+                                              produced, chunk_size, overlaps)
+                else:
+                    planned = plan_contexts(comp, satellite, intervals, hirs2nc_delivery_id,
+                                            produced, overlaps)
+
+                for interval, contexts in planned:
+                    LOG.info("{} {} -> {}: there are {} contexts".format(
+                        satellite, interval.left, interval.right, len(contexts)))
+                    self.count('contexts', len(contexts))
+                    if contexts:
+                        work.put((comp, satellite, interval, contexts))
+        finally:
+            for thread in workers:
+                work.put(None)
+            for thread in workers:
+                thread.join()
+
+            LOG.info("Closing log file {}".format(self.log_name))
+            self.file_obj.close()
+
+            if produced is not None:
+                self.summary['skipped'] = produced.skipped - skipped
+            if overlaps is not None:
+                self.summary['overlapping'] = overlaps.counts['dropped'] - dropped
+                LOG.info(overlaps.report())
+
+        LOG.info("Submitted {submitted} of {contexts} contexts as {jobs} jobs, {failed} failed,"
+                 " {skipped} skipped as already produced, in {elapsed:.1f} seconds".format(
+                     elapsed=time.time() - start, **self.summary))
+
+        return self.summary
@@ -0,0 +1,201 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+worker.py
+
+ * DESCRIPTION: A long-lived hirs2nc converter. Run as a script by the python of a delivered
+ environment, it reads one JSON job per line on stdin, {"args": [...], "cwd": ...}, runs the
+ hirs2nc script with those arguments in the same interpreter, and replies with one JSON line
+ {"rc": ..., "error": ..., "usage": {...}} on stdout, usage being the CPU time and block I/O of
+ the job, and the peak memory of the worker over its life so far. The interpreter and the modules hirs2nc imports are then loaded once per
+ worker, rather than once per granule.
+
+ Imported, it provides ConverterWorker, which starts and talks to such a process. This module
+ uses only the standard library, as the delivered environment has no flo.
+
+Copyright (c) 2018 University of Wisconsin Regents.
+Licensed under GNU GPLv3.
+"""
+
+import os
+import sys
+import json
+import atexit
+import logging
+import time
+import runpy
+import select
+import resource
+import traceback
+import subprocess
+from os.path import abspath, splitext
+
+LOG = logging.getLogger(__name__)
+
+# The running workers, keyed by (python interpreter, hirs2nc script)
+workers = {}
+
+class ConverterWorker(object):
+    '''
+    A worker process which runs the hirs2nc script hirs2nc_bin with py_interp, in the
+    environment env. A job which takes longer than timeout seconds is abandoned, and the worker
+    killed.
+    '''
+
+    timeout = 3600.
+
+    def __init__(self, py_interp, hirs2nc_bin, env=None, timeout=None):
+        self.py_interp = py_interp
+        self.hirs2nc_bin = hirs2nc_bin
+        self.env = env
+        if timeout is not None:
+            self.timeout = timeout
+        self.process = None
+        self.jobs = 0
+        # The resource usage of the worker for the last job
+        self.last_usage = {}
+
+    def start(self):
+        LOG.debug("Starting a hirs2nc worker for {}".format(self.hirs2nc_bin))
+        self.process = subprocess.Popen(
+            [self.py_interp, splitext(abspath(__file__))[0] + '.py', self.hirs2nc_bin],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, env=self.env,
+            universal_newlines=True)
+        self.jobs = 0
+
+    def alive(self):
+        return self.process is not None and self.process.poll() is None
+
+    def read_reply(self):
+        '''
+        The next line the worker writes to stdout, or '' if it exits first. Raises IOError if
+        no line has been written within the timeout.
+        '''
+        fd = self.process.stdout.fileno()
+        deadline = time.time() + self.timeout
+        reply = b''
+        while not reply.endswith(b'\n'):
+            remaining = deadline - time.time()
+            if remaining <= 0 or not select.select([fd], [], [], remaining)[0]:
+                raise IOError("hirs2nc worker gave no reply within {} seconds".format(
+                    self.timeout))
+            data = os.read(fd, 65536)
+            if not data:
+                return ''
+            reply += data
+        return reply.decode('utf-8')
+
+    def convert(self, args, cwd=None):
+        '''
+        Run hirs2nc with the arguments args in the directory cwd, and return its exit status.
+        Raises IOError if the worker cannot be started, stops responding, or takes longer than
+        the timeout, in which case it is killed.
+        '''
+        if not self.alive():
+            self.start()
+
+        job = json.dumps({'args': [str(arg) for arg in args], 'cwd': cwd or os.getcwd()})
+        try:
+            self.process.stdin.write(job + '\n')
+            self.process.stdin.flush()
+            reply = self.read_reply()
+        except (IOError, OSError, ValueError) as err:
+            self.stop(kill=True)
+            raise IOError("hirs2nc worker failed: {}".format(err))
+
+        if not reply:
+            self.stop()
+            raise IOError("hirs2nc worker exited with status {}".format(self.process.returncode))
+
+        reply = json.loads(reply)
+        self.jobs += 1
+        self.last_usage = reply.get('usage', {})
+        if reply['error']:
+            LOG.error(reply['error'])
+
+        return reply['rc']
+
+    def stop(self, kill=False):
+        if self.process is None:
+            return
+        if kill and self.process.poll() is None:
+            LOG.warning("Killing the hirs2nc worker for {}".format(self.hirs2nc_bin))
+            self.process.kill()
+        try:
+            self.process.stdin.close()
+        except (IOError, OSError):
+            pass
+        self.process.wait()
+        LOG.debug("Stopped the hirs2nc worker for {} after {} jobs".format(
+            self.hirs2nc_bin, self.jobs))
+
+def get_worker(py_interp, hirs2nc_bin, env=None):
+    '''
+    Return the worker for py_interp and hirs2nc_bin, creating it the first time.
+    '''
+    key = (py_interp, hirs2nc_bin)
+    if key not in workers:
+        workers[key] = ConverterWorker(py_interp, hirs2nc_bin, env=env)
+    return workers[key]
+
+@atexit.register
+def stop_workers():
+    for worker in workers.values():
+        worker.stop()
+    workers.clear()
+
+def exit_status(code):
+    '''
+    The process exit status for the argument of sys.exit().
+    '''
+    if code is None:
+        return 0
+    if isinstance(code, int):
+        return code
+    sys.stderr.write('{}\n'.format(code))
+    return 1
+
+def usage():
+    '''
+    The resource usage of this process and its finished children, as a dict.
+    '''
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return {'worker_utime': own.ru_utime + children.ru_utime,
+            'worker_stime': own.ru_stime + children.ru_stime,
+            'worker_lifetime_maxrss_kb': max(own.ru_maxrss, children.ru_maxrss),
+            'worker_inblock': own.ru_inblock + children.ru_inblock,
+            'worker_oublock': own.ru_oublock + children.ru_oublock}
+
+def serve(hirs2nc_bin):
+    '''
+    Answer the jobs on stdin, running hirs2nc_bin for each of them.
+    '''
+    # Keep the real stdout for the replies, and send anything hirs2nc prints to stderr
+    replies = os.fdopen(os.dup(sys.stdout.fileno()), 'w')
+    sys.stdout.flush()
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+
+    for line in iter(sys.stdin.readline, ''):
+        job = json.loads(line)
+        rc, error = 0, None
+        start_usage = usage()
+
+        try:
+            os.chdir(job['cwd'])
+            sys.argv = [hirs2nc_bin] + [str(arg) for arg in job['args']]
+            runpy.run_path(hirs2nc_bin, run_name='__main__')
+        except SystemExit as err:
+            rc = exit_status(err.code)
+        except Exception:
+            rc, error = 1, traceback.format_exc()
+
+        sys.stdout.flush()
+        sys.stderr.flush()
+        job_usage = dict((key, value if key.endswith('_maxrss_kb') else value - start_usage[key])
+                         for key, value in usage().items())
+        replies.write(json.dumps({'rc': rc, 'error': error, 'usage': job_usage}) + '\n')
+        replies.flush()
+
+if __name__ == '__main__':
+    serve(sys.argv[1])
@@ -10,13 +10,14 @@ Licensed under GNU GPLv3.
 
 import traceback
 import calendar
-from time import sleep
 import logging
 
-from flo.ui import safe_submit_order
 from timeutil import TimeInterval, datetime, timedelta
 
 import flo.sw.hirs2nc as hirs2nc
+from flo.sw.hirs2nc.delta import OverlapResolver
+from flo.sw.hirs2nc.products import ProductIndex
+from flo.sw.hirs2nc.submit import SubmissionEngine
 from flo.sw.hirs2nc.utils import setup_logging
 
 # every module should have a LOG object
@@ -50,6 +51,30 @@ intervals = []
 for years in range(2016, 2018):
     intervals += [TimeInterval(datetime(years,month,1), datetime(years,month,calendar.monthrange(years,month)[1])+day-wedge) for month in range(1,13) ]
 
+satellites = [satellite]
+
+# The most submissions to have in flight at once
+max_workers = 4
+
+# Skip the granules which already have a product, listed in a manifest and/or found by a scan
+# of the product store. The product_root must hold the products of hirs2nc_delivery_id alone,
+# and may contain '{hirs2nc_delivery_id}'. Leave both as None to submit every granule.
+product_manifest = None
+product_root = None
+
+# Leave out the granules mostly covered by overlapping ones, with the OverlapResolver policy
+# 'longest' or 'coverage', dropping those covered for at least overlap_threshold of their
+# duration. None submits every granule.
+overlap_policy = None
+overlap_threshold = 0.9
+
+# Convert a day of granules per task with HIRS2NCBatch, rather than one granule per task
+batch = False
+
+# Stream the contexts of each interval from the catalog, submitting them in lists made from
+# this many granules, rather than finding them all first. None finds them all first.
+chunk_size = None
+
 satellite_choices = ['noaa-06', 'noaa-07', 'noaa-08', 'noaa-09', 'noaa-10', 'noaa-11',
                     'noaa-12', 'noaa-14', 'noaa-15', 'noaa-16', 'noaa-17', 'noaa-18',
                     'noaa-19', 'metop-a', 'metop-b']
@@ -68,10 +93,10 @@ def setup_computation(satellite):
     input_sources = {'collection':collection, 'input_data':input_data}
 
     # Initialize the hirs2nc module with the data locations
-    hirs2nc.set_input_sources(input_sources)
+    hirs2nc.set_input_sources(input_sources, satellite=satellite)
 
     # Instantiate the computation
-    comp = hirs2nc.HIRS2NC()
+    comp = hirs2nc.HIRS2NCBatch() if batch else hirs2nc.HIRS2NC()
 
     return comp
 
@@ -79,54 +104,31 @@ LOG.info("Submitting intervals...")
 
 dt = datetime.utcnow()
 log_name = 'hirs2nc_{}_s{}_e{}_c{}.log'.format(
-    satellite,
+    '_'.join(satellites),
     intervals[0].left.strftime('%Y%m%d%H%M'),
     intervals[-1].right.strftime('%Y%m%d%H%M'),
     dt.strftime('%Y%m%d%H%M%S'))
 
 try:
-
-    for interval in intervals:
-        LOG.info("Submitting interval {} -> {}".format(interval.left, interval.right))
-
-        comp = setup_computation(satellite)
-
-        contexts =  comp.find_contexts(interval, satellite, hirs2nc_delivery_id)
-
-        LOG.info("Opening log file {}".format(log_name))
-        file_obj = open(log_name,'a')
-
-        LOG.info("\tThere are {} contexts in this interval".format(len(contexts)))
-        contexts.sort()
-
-        if contexts != []:
-            #for context in contexts:
-                #LOG.info(context)
-
-            LOG.info("\tFirst context: {}".format(contexts[0]))
-            LOG.info("\tLast context:  {}".format(contexts[-1]))
-
-            try:
-                job_nums = []
-                job_nums = safe_submit_order(comp, [comp.dataset('out')], contexts)
-
-                if job_nums != []:
-                    #job_nums = range(len(contexts))
-                    #LOG.info("\t{}".format(job_nums))
-
-                    file_obj.write("contexts: [{}, {}]; job numbers: [{}..{}]\n".format(contexts[0], contexts[-1], job_nums[0],job_nums[-1]))
-                    LOG.info("contexts: [{}, {}]; job numbers: [{},{}]".format(contexts[0], contexts[-1], job_nums[0],job_nums[-1]))
-                    LOG.info("job numbers: [{}..{}]\n".format(job_nums[0],job_nums[-1]))
-                else:
-                    LOG.info("contexts: [{}, {}]; --> no jobs\n".format(contexts[0], contexts[-1]))
-                    file_obj.write("contexts: [{}, {}]; --> no jobs\n".format(contexts[0], contexts[-1]))
-            except Exception:
-                LOG.warning(traceback.format_exc())
-
-            sleep(5.)
-
-        LOG.info("Closing log file {}".format(log_name))
-        file_obj.close()
+    produced = None
+    if product_manifest is not None or product_root is not None:
+        produced = ProductIndex()
+        if product_manifest is not None:
+            produced.read_manifest(product_manifest)
+        if product_root is not None:
+            produced.scan(product_root, hirs2nc_delivery_id, hirs2nc.HIRS2NC().satellite_version)
+
+    # Leave the produced granules out of the batch tasks too
+    hirs2nc.set_products(produced)
+
+    overlaps = None
+    if overlap_policy is not None:
+        overlaps = OverlapResolver(overlap_policy, overlap_threshold)
+
+    engine = SubmissionEngine(log_name, max_workers=max_workers)
+    summary = engine.run(setup_computation, satellites, intervals, hirs2nc_delivery_id,
+                         produced=produced, chunk_size=chunk_size, overlaps=overlaps)
+    LOG.info("Skipped {} granules which were already produced".format(summary['skipped']))
 
 except Exception:
     LOG.warning(traceback.format_exc())